@@ -0,0 +1,118 @@
+import os
+import sys
+import resource
+import threading
+import pyarrow as pa
+from prefetch import parse_size, settings as prefetch_settings
+
+MIN_BATCH_ROWS = 10_000
+MAX_BATCH_ROWS = 50_000_000
+# 有内存预算时按 UNIT_ROWS 行的小批次读取，再拼成目标行数
+UNIT_ROWS = 65_536
+# 没有观测值之前，parquet 元数据中的未压缩大小乘以该系数作为内存中每行字节数的初值（pandas 对象列开销较大）
+PRIOR_FACTOR = 4
+# 新的观测值更大时立即采用，更小时按该比例缓慢回落
+DECAY = 0.8
+SAFETY = 0.8
+
+settings = {'max_memory': None}
+
+# 按内存预算自适应批次大小（--max-memory 8G）：
+#   每行字节数 —— 初值取自 parquet 元数据（所读列的未压缩大小 / 行数），之后由各阶段处理完一个批次后报告的
+#                 实际工作集（例如 JSON 展开后的 DataFrame、展开后的商品表）修正；
+#   可用内存 —— 预算减去当前常驻内存，再加回已发出但尚未报告的批次（它们处理完就会释放）；
+#   同时存在的批次 —— 当前批次加上预取队列中的批次，共 1 + 预取深度个。
+# 下一个批次的行数 = SAFETY × 可用内存 / (每行字节数 × 同时存在的批次数)，限制在 [MIN_BATCH_ROWS, MAX_BATCH_ROWS]。
+# 未设置预算时各阶段沿用原来固定的 CHUNKSIZE，分块边界不变。
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # 没有 /proc 时退回进程的峰值内存，估计偏保守
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def metadata_bytes_per_row(metadata, columns=None):
+    total, rows = 0, 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        rows += row_group.num_rows
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if columns is None or column.path_in_schema.split('.')[0] in columns:
+                total += column.total_uncompressed_size
+    return total / rows if rows else 0.0
+
+class BatchSizer:
+    def __init__(self, budget, min_rows=MIN_BATCH_ROWS, max_rows=MAX_BATCH_ROWS):
+        self.budget = budget
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.bytes_per_row = None
+        self.outstanding_rows = 0
+        self.lock = threading.Lock()
+
+    def prime(self, metadata, columns=None):
+        if self.bytes_per_row is None:
+            self.bytes_per_row = max(metadata_bytes_per_row(metadata, columns) * PRIOR_FACTOR, 1.0)
+
+    def observe(self, rows, nbytes):
+        # rows 为该批次的输入行数，nbytes 为处理该批次时的工作集大小
+        with self.lock:
+            self.outstanding_rows = max(0, self.outstanding_rows - rows)
+            if rows:
+                observed = nbytes / rows
+                current = self.bytes_per_row or observed
+                self.bytes_per_row = max(observed, DECAY * current + (1 - DECAY) * observed)
+
+    def rows(self):
+        with self.lock:
+            per_row = self.bytes_per_row or 1024.0
+            free = self.budget - current_rss_bytes() + self.outstanding_rows * per_row
+            concurrent = 1 + max(prefetch_settings['depth'], 0)
+            rows = int(SAFETY * free / (per_row * concurrent))
+            return min(max(rows, self.min_rows), self.max_rows)
+
+    def split(self, batches):
+        # 按当前估计重新切分批次；发出的行在 observe 之前都计为占用中
+        for table in rebatch(batches, self.rows):
+            with self.lock:
+                self.outstanding_rows += table.num_rows
+            yield table
+
+    def split_batches(self, batches):
+        # 与 ParquetFile.iter_batches 一样输出单个连续的 RecordBatch
+        for table in self.split(batches):
+            yield table.combine_chunks().to_batches()[0]
+
+def batch_sizer(budget=None):
+    # 未设置内存预算时返回 None，调用方保持固定的批次大小
+    budget = settings['max_memory'] if budget is None else budget
+    return BatchSizer(budget) if budget else None
+
+def rebatch(batches, batch_size):
+    # 把扫描器按行组切出的小批次重新拼成 batch_size 行的表，未过滤时与 ParquetFile.iter_batches 的切分一致；
+    # batch_size 也可以是每次返回目标行数的函数（例如 BatchSizer.rows）
+    target = batch_size if callable(batch_size) else (lambda: batch_size)
+    pending, rows, size = [], 0, target()
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, size)
+            rest = table.slice(size)
+            pending, rows, size = rest.to_batches(), rest.num_rows, target()
+    if rows:
+        yield pa.Table.from_batches(pending)
+
+def add_memory_argument(parser):
+    parser.add_argument('--max-memory', help='内存预算，例如 8G；设置后按预算自适应调整批次大小')
+    return parser
+
+def configure(args):
+    settings['max_memory'] = parse_size(args.max_memory) if args.max_memory else None
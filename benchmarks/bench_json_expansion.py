@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clean_and_dedup import process_expansion, process_expansion_rowwise, default_columns
+
+CATEGORIES = ['电子产品', '服装', '食品', '家居', '玩具', '书籍']
+PAYMENT_METHODS = ['支付宝', '微信支付', '信用卡', '银联', '现金']
+PAYMENT_STATUS = ['已支付', '已退款', '部分退款']
+
+def make_purchase_history(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n):
+        rows.append(json.dumps({
+            'avg_price': round(float(rng.uniform(10, 10000)), 2),
+            'categories': CATEGORIES[rng.integers(len(CATEGORIES))],
+            'items': [{'id': int(i)} for i in rng.integers(0, 10000, rng.integers(1, 8))],
+            'payment_method': PAYMENT_METHODS[rng.integers(len(PAYMENT_METHODS))],
+            'payment_status': PAYMENT_STATUS[rng.integers(len(PAYMENT_STATUS))],
+            'purchase_date': f"2020-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}"
+        }, ensure_ascii=False))
+    return pd.DataFrame({'id': np.arange(n), 'purchase_history': rows})
+
+def measure(fn, df, columns):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = fn(df, columns)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # tracemalloc 只统计 Python 堆，Arrow 内存池的分配单独累加
+    return out, elapsed, peak + pa.default_memory_pool().max_memory()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='对比逐行 json.loads 与列式 JSON 解码的展开性能')
+    parser.add_argument('--rows', type=int, default=500_000)
+    args = parser.parse_args()
+
+    df = make_purchase_history(args.rows)
+    columns = default_columns()
+    new, new_time, new_peak = measure(process_expansion, df, columns)
+    old, old_time, old_peak = measure(process_expansion_rowwise, df, columns)
+
+    for col in ['purchase_avg_price', 'purchase_categories', 'payment_method', 'payment_status', 'purchase_date']:
+        assert (old[col].astype(object).values == new[col].astype(object).values).all(), col
+    assert [[d['id'] for d in x] for x in old['purchase_item_ids']] == [[d['id'] for d in x] for x in new['purchase_item_ids']]
+
+    print(f"行数: {args.rows}")
+    print(f"逐行解析: {old_time:.2f} 秒, 峰值内存 {old_peak / 2**20:.1f} MiB")
+    print(f"列式解析: {new_time:.2f} 秒, 峰值内存 {new_peak / 2**20:.1f} MiB")
+    print(f"加速比: {old_time / new_time:.1f}x")
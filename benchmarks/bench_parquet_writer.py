@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+from synthetic_data import generate, add_arguments, generator_params
+
+# 对比不同写出配置在 clean / expanded 两类数据上的写入时间、文件大小和下游读取时间：
+#   full —— 读取全部列并转为 DataFrame；tasks —— 只读取任务 1–4 用到的列；
+#   filter —— 按 user_id 取约 1% 的用户（排序后的行组统计可以跳过不相关的行组）。
+TASK_COLUMNS = ['user_id', 'purchase_date', 'item_category', 'payment_method', 'payment_status', 'is_high_value']
+
+def configurations(row_group_size):
+    from parquet_writer import ParquetOutput
+    return {
+        'brotli(旧)': ParquetOutput('brotli', None, 'none', row_group_size),
+        'snappy': ParquetOutput('snappy', None, 'auto', row_group_size),
+        'lz4': ParquetOutput('lz4', None, 'auto', row_group_size),
+        'zstd-1': ParquetOutput('zstd', 1, 'auto', row_group_size),
+        'zstd-3': ParquetOutput('zstd', 3, 'auto', row_group_size),
+        'zstd-9': ParquetOutput('zstd', 9, 'auto', row_group_size),
+        'zstd-3+排序': ParquetOutput('zstd', 3, 'auto', row_group_size, sort_by=['user_id', 'purchase_date'])
+    }
+
+def prepare_inputs(workdir, params):
+    generate(workdir, **params)
+    os.chdir(workdir)
+    from clean_and_dedup import preprocess, OUTPUT_DIR
+    from expand_items_and_join_catalog import main as expand
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        preprocess('./data', OUTPUT_DIR)
+        expand()
+    clean = pa.concat_tables([pq.read_table(os.path.join(OUTPUT_DIR, f)) for f in sorted(os.listdir(OUTPUT_DIR))])
+    expanded_dir = './outputs/expanded_items_chunks'
+    expanded = pa.concat_tables([pq.read_table(os.path.join(expanded_dir, f)) for f in sorted(os.listdir(expanded_dir))])
+    return {'clean': clean.rename_columns(['user_id' if c == 'id' else c for c in clean.column_names]),
+            'expanded': expanded}
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def row_group_statistics(metadata, column):
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            if row_group.column(j).path_in_schema == column:
+                yield row_group.column(j).statistics
+
+def benchmark(name, table, writer, out_dir, repeat):
+    path = os.path.join(out_dir, 'bench.parquet')
+    write_s, size = timed(lambda: writer.write(table, path), repeat)
+    read_s, _ = timed(lambda: pq.read_table(path).to_pandas(), repeat)
+    columns = [c for c in TASK_COLUMNS if c in table.column_names]
+    task_s, _ = timed(lambda: pq.read_table(path, columns=columns).to_pandas(), repeat)
+    ids = table.column('user_id')
+    lo = pc.min(ids).as_py()
+    hi = lo + max(1, (pc.max(ids).as_py() - lo) // 100)
+    filter_s, filtered = timed(lambda: pq.read_table(path, filters=[('user_id', '>=', lo), ('user_id', '<', hi)]), repeat)
+    metadata = pq.ParquetFile(path).metadata
+    groups = sum(1 for stats in row_group_statistics(metadata, 'user_id') if stats.min < hi and stats.max >= lo)
+    print(f"{name:<14}{write_s:>9.3f}{size / 2**20:>10.2f}{read_s:>9.3f}{task_s:>9.3f}{filter_s:>9.3f}"
+          f"{groups:>6}/{metadata.num_row_groups:<4}{filtered.num_rows:>8}")
+
+if __name__ == '__main__':
+    parser = add_arguments(argparse.ArgumentParser(description='对比 parquet 写出配置的写入时间、文件大小与读取时间'))
+    parser.add_argument('--row-group-size', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.set_defaults(rows=400_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_parquet_writer_')
+    try:
+        tables = prepare_inputs(workdir, generator_params(args))
+        out_dir = os.path.join(workdir, 'bench')
+        os.makedirs(out_dir)
+        for kind, table in tables.items():
+            print(f"\n{kind}: {table.num_rows} 行, {table.num_columns} 列")
+            print(f"{'配置':<12}{'写入(秒)':>9}{'大小(MiB)':>10}{'全读(秒)':>9}{'任务列':>9}{'过滤':>9}{'命中行组':>11}{'过滤行数':>8}")
+            for name, writer in configurations(args.row_group_size).items():
+                benchmark(name, table, writer, out_dir, args.repeat)
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
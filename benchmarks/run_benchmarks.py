@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, BENCH_DIR)
+from synthetic_data import generate, add_arguments, generator_params
+
+# 基准测试：先用 synthetic_data 生成数据，再把每个阶段放在独立的子进程中运行，
+# 记录核心部分的墙钟时间、CPU 时间和子进程的峰值 RSS（含准备数据的部分，另记准备完成时的 RSS 作参照）。
+# 各阶段按顺序运行，后面的阶段使用前面阶段写出的 clean / expanded 数据。
+# 结果保存为 results/<commit>.json，可用 --compare 与另一次结果对比。
+
+def current_rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def parquet_paths(directory):
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.parquet')]
+
+def setup_dedup(mode):
+    import pyarrow.parquet as pq
+    from dedup import DedupFilter, hash_keys, DEDUP_KEYS
+    frames = [pq.read_table(path, columns=DEDUP_KEYS).to_pandas() for path in parquet_paths('./data')]
+
+    def run():
+        dedup_filter = DedupFilter(mode=mode)
+        duplicates = 0
+        for df in frames:
+            h1, h2 = hash_keys(df, DEDUP_KEYS)
+            duplicates += int(dedup_filter.check_and_add(h1, h2).sum())
+        return {'rows_in': sum(len(df) for df in frames), 'duplicates': duplicates}
+    return run
+
+def setup_json_expansion():
+    import pyarrow.parquet as pq
+    from clean_and_dedup import process_expansion, default_columns
+    frames = [pq.read_table(path, columns=['id', 'purchase_history']).to_pandas() for path in parquet_paths('./data')]
+
+    def run():
+        rows = sum(len(process_expansion(df, default_columns())) for df in frames)
+        return {'rows_in': rows}
+    return run
+
+def setup_clean():
+    from clean_and_dedup import preprocess, OUTPUT_DIR
+    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
+
+    def run():
+        stats = preprocess('./data', OUTPUT_DIR)
+        return {'duplicates': stats['duplicates_removed'], 'chunks': stats['chunks_processed']}
+    return run
+
+def setup_catalog_compile():
+    from product_catalog import compile_catalog
+
+    def run():
+        meta = compile_catalog()
+        return {'categories': len(meta['categories'])}
+    return run
+
+def setup_catalog_join():
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from product_catalog import get_catalog
+    from expand_items_and_join_catalog import INPUT_DIR
+    ids = [pc.struct_field(pc.list_flatten(pq.read_table(path, columns=['purchase_item_ids']).column(0)), 'id')
+           for path in parquet_paths(INPUT_DIR)]
+    catalog = get_catalog()
+
+    def run():
+        return {'rows_in': sum(len(catalog.lookup(part)[1]) for part in ids)}
+    return run
+
+def setup_expand():
+    from expand_items_and_join_catalog import main, OUTPUT_DIR
+    for path in parquet_paths(OUTPUT_DIR):
+        os.remove(path)
+
+    def run():
+        main()
+        return {'files_out': len(parquet_paths(OUTPUT_DIR))}
+    return run
+
+def load_expanded(columns):
+    import pyarrow.parquet as pq
+    from scan_driver import EXPANDED_DIR
+    return [pq.read_table(path, columns=columns).to_pandas() for path in parquet_paths(EXPANDED_DIR)]
+
+def build_task1_transactions(frames):
+    from task1_association_rules import CategoryTransactionTask
+    task = CategoryTransactionTask()
+    for df in frames:
+        task.consume(df)
+    return task.builder.build()
+
+def setup_transactions():
+    from task1_association_rules import CategoryTransactionTask
+    frames = load_expanded(CategoryTransactionTask.columns)
+
+    def run():
+        transactions = build_task1_transactions(frames)
+        return {'rows_in': sum(len(df) for df in frames), 'transactions': len(transactions)}
+    return run
+
+def setup_fpgrowth():
+    from mining import mine_frequent_itemsets
+    from task1_association_rules import CategoryTransactionTask, MIN_SUPPORT
+    transactions = build_task1_transactions(load_expanded(CategoryTransactionTask.columns))
+
+    def run():
+        itemsets = mine_frequent_itemsets(transactions, MIN_SUPPORT)
+        return {'transactions': len(transactions), 'itemsets': len(itemsets)}
+    return run
+
+def setup_task3():
+    from task3_time_series_analysis import TimeSeriesTask
+    frames = load_expanded(TimeSeriesTask.columns)
+
+    def run():
+        task = TimeSeriesTask()
+        for df in frames:
+            task.consume(df)
+        _, _, sequence_df = task.finish()
+        return {'rows_in': sum(len(df) for df in frames), 'pairs': len(sequence_df)}
+    return run
+
+STAGES = {
+    'dedup_bloom': lambda: setup_dedup('bloom'),
+    'dedup_exact': lambda: setup_dedup('exact'),
+    'json_expansion': setup_json_expansion,
+    'clean': setup_clean,
+    'catalog_compile': setup_catalog_compile,
+    'catalog_join': setup_catalog_join,
+    'expand': setup_expand,
+    'transactions': setup_transactions,
+    'fpgrowth': setup_fpgrowth,
+    'task3': setup_task3
+}
+# 依赖前面阶段写出的 clean / expanded 数据的阶段
+DEPENDS = {
+    'catalog_join': ['clean'],
+    'expand': ['clean'],
+    'transactions': ['clean', 'expand'],
+    'fpgrowth': ['clean', 'expand'],
+    'task3': ['clean', 'expand']
+}
+
+def run_stage(name, workdir, verbose=False):
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with output:
+        run = STAGES[name]()
+        rss_before = current_rss_bytes()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        info = run()
+        wall = time.perf_counter() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (end_usage.ru_utime + end_usage.ru_stime) - (usage.ru_utime + usage.ru_stime)
+    return dict(info, wall_s=round(wall, 4), cpu_s=round(cpu, 4), rss_before_bytes=rss_before,
+                peak_rss_bytes=end_usage.ru_maxrss * 1024)
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, text=True).strip()
+        return commit, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+def environment():
+    import numpy, pandas, pyarrow
+    return {
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+        'numpy': numpy.__version__, 'pandas': pandas.__version__, 'pyarrow': pyarrow.__version__
+    }
+
+def prepare_data(workdir, params):
+    # 参数相同时复用已生成的数据
+    params_path = os.path.join(workdir, 'params.json')
+    if os.path.exists(params_path):
+        with open(params_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == params:
+                return
+    shutil.rmtree(workdir, ignore_errors=True)
+    generate(workdir, **params)
+    with open(params_path, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+
+def summarize(runs):
+    walls = sorted(r['wall_s'] for r in runs)
+    return {
+        'wall_s': walls[len(walls) // 2],
+        'cpu_s': sorted(r['cpu_s'] for r in runs)[len(runs) // 2],
+        'peak_rss_bytes': max(r['peak_rss_bytes'] for r in runs),
+        'runs': runs
+    }
+
+def compare(current, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n对比基线 {baseline['commit']}（{baseline_path}）：")
+    print(f"{'阶段':<16}{'基线(秒)':>10}{'当前(秒)':>10}{'加速比':>8}{'基线RSS(MiB)':>14}{'当前RSS(MiB)':>14}")
+    for name, result in current['stages'].items():
+        old = baseline['stages'].get(name)
+        if old is None:
+            continue
+        speedup = old['wall_s'] / result['wall_s'] if result['wall_s'] else float('inf')
+        print(f"{name:<16}{old['wall_s']:>10.3f}{result['wall_s']:>10.3f}{speedup:>7.2f}x"
+              f"{old['peak_rss_bytes'] / 2**20:>14.1f}{result['peak_rss_bytes'] / 2**20:>14.1f}")
+
+if __name__ == '__main__':
+    parser = add_arguments(argparse.ArgumentParser(description='在合成数据上对各处理阶段计时并测量内存'))
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'data_mining_hw2_bench'))
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='结果文件路径，默认 results/<commit>.json')
+    parser.add_argument('--compare', help='与之前保存的结果文件对比')
+    parser.add_argument('--verbose', action='store_true', help='显示各阶段自身的输出')
+    args = parser.parse_args()
+
+    params = generator_params(args)
+    prepare_data(args.workdir, params)
+    commit, dirty = git_revision()
+    results = {
+        'commit': commit, 'dirty': dirty, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': params, 'environment': environment(), 'stages': {}
+    }
+    # 所选阶段依赖的 clean / expand 自动补跑一次，但不计入结果
+    needed = set(args.stages).union(*(DEPENDS.get(name, []) for name in args.stages))
+    stages = [name for name in STAGES if name in needed]
+    for name in stages:
+        runs = []
+        for _ in range(args.repeat if name in args.stages else 1):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                runs.append(pool.submit(run_stage, name, args.workdir, args.verbose).result())
+        if name in args.stages:
+            results['stages'][name] = summarize(runs)
+            print(f"{name:<16} {results['stages'][name]['wall_s']:>8.3f} 秒  CPU {results['stages'][name]['cpu_s']:>8.3f} 秒  "
+                  f"峰值 RSS {results['stages'][name]['peak_rss_bytes'] / 2**20:>8.1f} MiB")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    if args.compare:
+        compare(results, args.compare)
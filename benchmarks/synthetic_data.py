@@ -0,0 +1,157 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ['电子产品', '服装', '食品', '家居', '玩具', '书籍', '运动户外', '美妆', '母婴', '汽车用品']
+PAYMENT_METHODS = ['支付宝', '微信支付', '信用卡', '银联', '现金']
+PAYMENT_STATUS = ['已支付', '已退款', '部分退款']
+GENDERS = ['男', '女', '其他']
+COUNTRIES = ['中国', '美国', '日本', '德国', '英国', '法国', '巴西', '印度']
+
+# 生成与 clean_and_dedup.column_loader 读取的原始数据同构的 parquet 文件和商品目录：
+#   id / last_login / user_name / fullname / age / income / gender / country / is_active / purchase_history
+# purchase_history 为 JSON 字符串，含 avg_price、categories、items（[{"id": ...}]）、payment_method、payment_status、purchase_date。
+# 可调参数：总行数、文件数、重复行比例（整行复制先前的行，可跨文件）、回购比例（沿用先前用户的资料，
+# last_login 与购买记录重新生成，去重后仍保留，每个用户因此有多次购买）、每单商品数的分布、商品目录大小、
+# 目录外商品 id 的比例、缺失值与异常值比例。同一组参数和种子总是生成相同的数据。
+
+def item_counts(rng, n, distribution='poisson', mean=3.0, max_items=20):
+    if distribution == 'poisson':
+        counts = rng.poisson(mean, n)
+    elif distribution == 'geometric':
+        counts = rng.geometric(1.0 / (mean + 1), n) - 1
+    elif distribution == 'zipf':
+        counts = rng.zipf(1.0 + 1.0 / max(mean, 0.1), n)
+    else:
+        raise ValueError(f"未知的商品数分布: {distribution}（可选 poisson / geometric / zipf）")
+    return np.clip(counts, 0, max_items)
+
+def make_catalog(catalog_size, seed=0):
+    rng = np.random.default_rng(seed)
+    categories = rng.integers(len(CATEGORIES), size=catalog_size)
+    prices = np.round(rng.lognormal(6.0, 1.2, catalog_size), 2)
+    return {'products': [{'id': int(i), 'category': CATEGORIES[c], 'price': float(p)}
+                         for i, (c, p) in enumerate(zip(categories, prices))]}
+
+def make_purchase_history(rng, n, catalog_size, distribution, items_mean, max_items, unknown_item_rate):
+    counts = item_counts(rng, n, distribution, items_mean, max_items)
+    # 商品 id 服从 Zipf 形状的流行度分布；unknown_item_rate 比例的 id 落在目录之外
+    ids = (rng.zipf(1.3, counts.sum()) - 1) % max(catalog_size, 1)
+    unknown = rng.random(len(ids)) < unknown_item_rate
+    ids[unknown] = catalog_size + rng.integers(1, 1000, unknown.sum())
+    item_text = np.char.add(np.char.add('{"id": ', ids.astype(str)), '}')
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    avg_price = np.round(rng.lognormal(6.0, 0.8, n), 2)
+    category = rng.integers(len(CATEGORIES), size=n)
+    method = rng.integers(len(PAYMENT_METHODS), size=n)
+    status = rng.choice(len(PAYMENT_STATUS), size=n, p=[0.8, 0.12, 0.08])
+    dates = np.datetime64('2020-01-01') + rng.integers(0, 4 * 365, n).astype('timedelta64[D]')
+    rows = []
+    for i in range(n):
+        rows.append(
+            f'{{"avg_price": {avg_price[i]}, "categories": {json.dumps(CATEGORIES[category[i]], ensure_ascii=False)}, '
+            f'"items": [{", ".join(item_text[bounds[i]:bounds[i + 1]])}], '
+            f'"payment_method": {json.dumps(PAYMENT_METHODS[method[i]], ensure_ascii=False)}, '
+            f'"payment_status": {json.dumps(PAYMENT_STATUS[status[i]], ensure_ascii=False)}, '
+            f'"purchase_date": "{dates[i]}"}}'
+        )
+    return rows
+
+def make_users(rng, n, first_id, missing_rate, outlier_rate):
+    ids = np.arange(first_id, first_id + n, dtype=np.int64)
+    age = rng.integers(18, 80, n).astype(float)
+    income = np.round(rng.lognormal(11.3, 0.4, n), 2)
+    outliers = rng.random(n) < outlier_rate
+    age[outliers] = rng.integers(120, 200, outliers.sum())
+    income[rng.random(n) < outlier_rate] *= 50
+    age[rng.random(n) < missing_rate] = np.nan
+    income[rng.random(n) < missing_rate] = np.nan
+    return pd.DataFrame({
+        'id': ids,
+        'last_login': make_last_login(rng, n),
+        'user_name': np.char.add('user_', ids.astype(str)),
+        'fullname': np.char.add('用户', ids.astype(str)),
+        'age': age,
+        'income': income,
+        'gender': np.array(GENDERS)[rng.integers(len(GENDERS), size=n)],
+        'country': np.array(COUNTRIES)[rng.integers(len(COUNTRIES), size=n)],
+        'is_active': rng.random(n) < 0.7
+    })
+
+def make_last_login(rng, n):
+    return (np.datetime64('2023-01-01T00:00:00') + rng.integers(0, 365 * 86400, n).astype('timedelta64[s]')).astype(str)
+
+def make_repeat_users(rng, pool, n):
+    # 同一用户的另一条记录：id、用户名等资料不变，last_login 不同
+    users = pool.iloc[rng.integers(len(pool), size=n)].reset_index(drop=True)
+    users['last_login'] = make_last_login(rng, n)
+    return users
+
+def generate(output_dir, rows=200_000, files=4, duplicate_rate=0.02, repeat_purchase_rate=0.0, catalog_size=10_000,
+             items_distribution='poisson', items_mean=3.0, max_items=20, unknown_item_rate=0.02,
+             missing_rate=0.001, outlier_rate=0.002, row_group_size=100_000, seed=0):
+    data_dir = os.path.join(output_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'product_catalog.json'), 'w', encoding='utf-8') as f:
+        json.dump(make_catalog(catalog_size, seed), f, ensure_ascii=False)
+
+    if not 0 <= repeat_purchase_rate < 1:
+        raise ValueError(f"回购比例必须在 [0, 1) 之间: {repeat_purchase_rate}")
+    rng = np.random.default_rng(seed)
+    per_file = np.diff(np.linspace(0, rows, files + 1).astype(np.int64))
+    previous, known_users = [], []
+    next_id = 0
+    for file_idx, n in enumerate(per_file):
+        n_dup = int(round(n * duplicate_rate))
+        n_new = n - n_dup
+        n_repeat = int(round(n_new * repeat_purchase_rate))
+        df = make_users(rng, n_new - n_repeat, next_id, missing_rate, outlier_rate)
+        next_id += n_new - n_repeat
+        if n_repeat:
+            # 回购用户取自之前文件和本文件的新用户，可跨文件
+            pool = pd.concat(known_users + [df], ignore_index=True)
+            df = pd.concat([df, make_repeat_users(rng, pool, n_repeat)], ignore_index=True)
+        if repeat_purchase_rate:
+            known_users.append(df.iloc[rng.integers(len(df), size=min(len(df), 10_000))])
+        df['purchase_history'] = make_purchase_history(rng, n_new, catalog_size, items_distribution,
+                                                       items_mean, max_items, unknown_item_rate)
+        if n_dup:
+            # 从之前文件和本文件已生成的行中整行复制，模拟跨文件与文件内的重复记录
+            pool = pd.concat(previous + [df], ignore_index=True)
+            df = pd.concat([df, pool.iloc[rng.integers(len(pool), size=n_dup)]], ignore_index=True)
+            df = df.iloc[rng.permutation(len(df))].reset_index(drop=True)
+        df.to_parquet(os.path.join(data_dir, f"part_{file_idx:04d}.parquet"), row_group_size=row_group_size, index=False)
+        previous.append(df.iloc[rng.integers(len(df), size=min(len(df), 10_000))])
+        print(f"已生成 {data_dir}/part_{file_idx:04d}.parquet: {len(df)} 行（其中重复 {n_dup} 行，回购 {n_repeat} 行）")
+    return data_dir
+
+def add_arguments(parser):
+    parser.add_argument('--rows', type=int, default=200_000, help='总行数（含重复行）')
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--duplicate-rate', type=float, default=0.02)
+    parser.add_argument('--repeat-purchase-rate', type=float, default=0.0,
+                        help='非重复行中属于已有用户再次购买的比例（同一 id，last_login 与购买日期不同）')
+    parser.add_argument('--catalog-size', type=int, default=10_000)
+    parser.add_argument('--items-distribution', choices=['poisson', 'geometric', 'zipf'], default='poisson')
+    parser.add_argument('--items-mean', type=float, default=3.0)
+    parser.add_argument('--max-items', type=int, default=20)
+    parser.add_argument('--unknown-item-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+def generator_params(args):
+    return {
+        'rows': args.rows, 'files': args.files, 'duplicate_rate': args.duplicate_rate,
+        'repeat_purchase_rate': args.repeat_purchase_rate,
+        'catalog_size': args.catalog_size, 'items_distribution': args.items_distribution,
+        'items_mean': args.items_mean, 'max_items': args.max_items,
+        'unknown_item_rate': args.unknown_item_rate, 'seed': args.seed
+    }
+
+if __name__ == '__main__':
+    parser = add_arguments(argparse.ArgumentParser(description='生成与原始数据同构的合成 parquet 数据和商品目录'))
+    parser.add_argument('--output-dir', default='./synthetic')
+    args = parser.parse_args()
+    generate(args.output_dir, **generator_params(args))
@@ -1,55 +1,156 @@
 import os
 import json
 import time
+import argparse
+import tempfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import json as pa_json
 from pandas import json_normalize
 from pyarrow.parquet import ParquetFile
-from pyarrow import Table, parquet as pq
-from hashlib import sha256
-from pybloom_live import ScalableBloomFilter as BaseSBF
+from pyarrow import Table
 from collections import defaultdict
-from tqdm import tqdm  
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from dedup import DedupFilter, hash_keys, first_occurrence, DEDUP_KEYS
+from manifest import Manifest, save_state, load_state
+from sketch import KLLSketch, SKETCH_K
+from metrics import stage, METRICS_PATH
+from parquet_writer import ParquetOutput, add_writer_arguments, writer_from_args
+from prefetch import prefetch, item_bytes, AsyncWriter, add_prefetch_arguments, configure as configure_prefetch
+from batching import (BatchSizer, batch_sizer, metadata_bytes_per_row, UNIT_ROWS, PRIOR_FACTOR,
+                      add_memory_argument, configure as configure_batching, settings as batching_settings)
 
 INPUT_DIR = './data'
 OUTPUT_DIR = './outputs/cleaned_chunks'
-LOG_FILE = './outputs/cleaning_log.txt'
 CHUNKSIZE = 5_000_000
+NUMERIC_COLS = ['age', 'income', 'purchase_avg_price']
+EXPANDED_FIELDS = {'purchase_avg_price', 'purchase_categories'}
+CLEAN_STAGE = 'clean'
+DEDUP_STATE = 'dedup_filter'
+SKETCH_STATE = 'outlier_sketches'
+IQR_FACTOR = 1.5
+# 清洗一个数据块时同时存在的副本：Arrow 批次、展开后的 DataFrame、过滤后的副本与写出时转换的 Arrow 表
+CLEAN_WORKING_SET = 3
+PURCHASE_FIELD_MAP = {
+    'avg_price': 'purchase_avg_price',
+    'categories': 'purchase_categories',
+    'items': 'purchase_item_ids',
+    'payment_method': 'payment_method',
+    'payment_status': 'payment_status',
+    'purchase_date': 'purchase_date'
+}
+PURCHASE_SCHEMA = {
+    'avg_price': pa.float64(),
+    'categories': pa.string(),
+    'items': pa.list_(pa.struct([('id', pa.int64())])),
+    'payment_method': pa.string(),
+    'payment_status': pa.string(),
+    'purchase_date': pa.string()
+}
+JSON_BLOCK_SIZE = 16 << 20
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+def list_parquet_files(parquet_dir):
+    return sorted(file for file in os.listdir(parquet_dir) if file.endswith('.parquet'))
+
+def resolve_columns(pf, columns=None):
+    has_raw = 'purchase_history' in pf.schema.names
+    if has_raw:
+        actual_columns = [col for col in columns if col not in EXPANDED_FIELDS] if columns else pf.schema.names
+        if any(col in EXPANDED_FIELDS for col in columns or []):
+            actual_columns.append('purchase_history')
+        return actual_columns, 'raw'
+    return columns, 'clean'
+
+def finalize_batch(df, process_mode, columns=None):
+    if process_mode == 'raw' and 'purchase_history' in df.columns:
+        df = process_expansion(df, columns)
+    return apply_dtype_optimization(df)
+
+def load_file_chunks(file_path, columns=None, chunksize=CHUNKSIZE, metrics=None, sizer=None):
+    # 后台线程预取并解码下一个批次，当前批次的展开与清洗同时在主线程进行；给出 sizer 时按内存预算决定批次行数
+    pf = ParquetFile(file_path)
+    actual_columns, process_mode = resolve_columns(pf, columns)
+    if sizer is None:
+        batches = pf.iter_batches(columns=actual_columns, batch_size=chunksize)
+    else:
+        sizer.prime(pf.metadata, actual_columns)
+        batches = sizer.split_batches(pf.iter_batches(columns=actual_columns, batch_size=UNIT_ROWS))
+    for batch in prefetch(batches, 'prefetch', metrics):
+        yield finalize_batch(batch.to_pandas(), process_mode, columns)
+
 def column_loader(parquet_dir, columns=None, chunksize=CHUNKSIZE):
-    expanded_fields = {'purchase_avg_price', 'purchase_categories'}
-    files = [file for file in os.listdir(parquet_dir) if file.endswith('.parquet')]
+    files = list_parquet_files(parquet_dir)
     for file in tqdm(files, desc='处理文件列表'):
-        file_path = os.path.join(parquet_dir, file)
         print(f"正在读取文件: {file}")
-        pf = ParquetFile(file_path)
-        has_raw = 'purchase_history' in pf.schema.names
-        if has_raw:
-            actual_columns = [col for col in columns if col not in expanded_fields] if columns else pf.schema.names
-            if any(col in expanded_fields for col in columns or []):
-                actual_columns.append('purchase_history')
-            process_mode = 'raw'
-        else:
-            actual_columns = columns
-            process_mode = 'clean'
-        for batch in pf.iter_batches(columns=actual_columns, batch_size=chunksize):
-            df = batch.to_pandas()
-            if process_mode == 'raw' and 'purchase_history' in df.columns:
-                df = process_expansion(df, columns)
-            df = apply_dtype_optimization(df)
-            yield df
+        yield from load_file_chunks(os.path.join(parquet_dir, file), columns, chunksize)
+
+def plan_chunks(parquet_dir, chunksize=CHUNKSIZE):
+    # 与 column_loader 的分块边界完全一致：每个文件按 chunksize 行切分
+    units = []
+    for file in list_parquet_files(parquet_dir):
+        file_path = os.path.join(parquet_dir, file)
+        num_rows = ParquetFile(file_path).metadata.num_rows
+        for start in range(0, num_rows, chunksize):
+            units.append((file_path, start, min(start + chunksize, num_rows)))
+    return units
+
+def read_chunk(file_path, start, stop, columns=None):
+    pf = ParquetFile(file_path)
+    actual_columns, process_mode = resolve_columns(pf, columns)
+    row_groups, first_row, offset = [], None, 0
+    for i in range(pf.metadata.num_row_groups):
+        rg_rows = pf.metadata.row_group(i).num_rows
+        if offset < stop and offset + rg_rows > start:
+            row_groups.append(i)
+            if first_row is None:
+                first_row = offset
+        offset += rg_rows
+    table = pf.read_row_groups(row_groups, columns=actual_columns).slice(start - first_row, stop - start)
+    return finalize_batch(table.to_pandas(), process_mode, columns)
+
+def decode_purchase_history(series, fields):
+    # 把每行 JSON 拼接成 NDJSON 缓冲区，由 Arrow 的 JSON 读取器一次性解码为列，只保留 fields 中的字段
+    arr = pa.array(series, type=pa.large_string(), from_pandas=True)
+    empty = pa.scalar('{}', pa.large_string())
+    arr = pc.fill_null(arr, empty)
+    arr = pc.if_else(pc.equal(pc.utf8_trim_whitespace(arr), ''), empty, arr)
+    arr = pc.replace_substring(arr, '\n', ' ')
+    arr = pc.binary_join_element_wise(arr, pa.scalar('', pa.large_string()), pa.scalar('\n', pa.large_string()))
+    offsets = np.frombuffer(arr.buffers()[1], dtype=np.int64)
+    begin, end = offsets[arr.offset], offsets[arr.offset + len(arr)]
+    buf = arr.buffers()[2].slice(begin, end - begin)
+    schema = pa.schema([(field, PURCHASE_SCHEMA[field]) for field in fields])
+    table = pa_json.read_json(
+        pa.BufferReader(buf),
+        read_options=pa_json.ReadOptions(block_size=JSON_BLOCK_SIZE),
+        parse_options=pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior='ignore')
+    )
+    if table.num_rows != len(series):
+        raise ValueError(f"解码行数 {table.num_rows} 与输入行数 {len(series)} 不一致")
+    return table
 
 def process_expansion(df, required_fields=None):
+    fields = [src for src, dst in PURCHASE_FIELD_MAP.items() if required_fields is None or dst in required_fields]
+    if not fields:
+        return df.drop('purchase_history', axis=1)
+    try:
+        table = decode_purchase_history(df['purchase_history'], fields)
+    except (pa.ArrowException, ValueError) as e:
+        print(f"列式解析失败，回退逐行解析: {str(e)}")
+        return process_expansion_rowwise(df, required_fields)
+    df_purchase = table.to_pandas()
+    df_purchase = df_purchase.rename(columns=PURCHASE_FIELD_MAP)
+    df_purchase.index = df.index
+    return pd.concat([df.drop('purchase_history', axis=1), df_purchase], axis=1)
+
+def process_expansion_rowwise(df, required_fields=None):
     try:
         parsed = df['purchase_history'].apply(lambda x: json.loads(x) if pd.notnull(x) else {})
-        df_purchase = json_normalize(parsed).rename(columns={
-            'avg_price': 'purchase_avg_price',
-            'categories': 'purchase_categories',
-            'items': 'purchase_item_ids',
-            'payment_method': 'payment_method',
-            'payment_status': 'payment_status',
-            'purchase_date': 'purchase_date'
-        })
+        df_purchase = json_normalize(parsed).rename(columns=PURCHASE_FIELD_MAP)
         merged = pd.concat([
             df.drop('purchase_history', axis=1),
             df_purchase[[col for col in df_purchase.columns if required_fields is None or col in required_fields]]
@@ -76,66 +177,323 @@ def apply_dtype_optimization(df):
     valid = {col: dtype for col, dtype in dtype_map.items() if col in df.columns}
     return df.astype(valid, errors='ignore')
 
-class ScalableBloomFilter:
-    def __init__(self, error_rate=0.001):
-        self.filter = BaseSBF(error_rate=error_rate)
-    def add(self, item):
-        exists = item in self.filter
-        self.filter.add(item)
-        return exists
-
-def save_clean_chunk(df, output_dir, chunk_idx):
+def save_clean_chunk(df, output_dir, chunk_idx, writer=None):
     path = os.path.join(output_dir, f"clean_{chunk_idx}.parquet")
-    table = Table.from_pandas(df)
-    pq.write_table(table, path, compression='brotli', use_dictionary=False)
+    writer = ParquetOutput() if writer is None else writer
+    return writer.write(Table.from_pandas(df), path)
 
-def preprocess(parquet_dir, output_dir, columns_to_keep=None):
-    if columns_to_keep is None:
-        columns_to_keep = [
-            'id', 'last_login', 'user_name', 'fullname', 'age', 'income',
-            'gender', 'country', 'is_active',
-            'purchase_avg_price', 'purchase_categories',
-            'purchase_item_ids', 'payment_method', 'payment_status', 'purchase_date'
-        ]
-    NUMERIC_COLS = ['age', 'income', 'purchase_avg_price']
-    dedup_filter = ScalableBloomFilter(error_rate=0.0001)
-    stats = {
+def default_columns():
+    return [
+        'id', 'last_login', 'user_name', 'fullname', 'age', 'income',
+        'gender', 'country', 'is_active',
+        'purchase_avg_price', 'purchase_categories',
+        'purchase_item_ids', 'payment_method', 'payment_status', 'purchase_date'
+    ]
+
+def new_stats():
+    return {
         'duplicates_removed': 0,
         'missing_filled': defaultdict(int),
         'outliers_removed': defaultdict(int),
+        'outlier_bounds': {},
         'chunks_processed': 0
     }
-    chunk_gen = column_loader(parquet_dir, columns=columns_to_keep)
-    for idx, chunk in enumerate(chunk_gen):
-        print(f"正在处理数据块 {idx}...")
+
+def merge_stats(total, part):
+    total['duplicates_removed'] += part['duplicates_removed']
+    for key, value in part['missing_filled'].items():
+        total['missing_filled'][key] += value
+    for key, value in part['outliers_removed'].items():
+        total['outliers_removed'][key] += value
+    total['chunks_processed'] += part['chunks_processed']
+    return total
+
+# 异常值过滤分两遍：第一遍只读取数值列，用 KLL 草图估计全局四分位数；第二遍对所有数据块使用同一组 IQR 边界。
+# 草图只看各列的非空值（去重、去缺失之前），k 越大边界越精确，见 sketch.py。
+def sketch_columns(pf):
+    has_raw = 'purchase_history' in pf.schema.names
+    return [col for col in NUMERIC_COLS if col in pf.schema.names or (has_raw and col in EXPANDED_FIELDS)]
+
+def update_sketches(sketches, df):
+    for col, sketch in sketches.items():
+        if col in df.columns:
+            sketch.update(df[col].to_numpy(dtype=np.float64, na_value=np.nan))
+    return sketches
+
+def new_sketches(k=SKETCH_K, seed=0):
+    return {col: KLLSketch(k, seed=seed + i) for i, col in enumerate(NUMERIC_COLS)}
+
+def merge_sketches(total, part):
+    for col, sketch in part.items():
+        total[col].merge(sketch)
+    return total
+
+def build_sketches(file_paths, k=SKETCH_K, chunksize=CHUNKSIZE, sketches=None):
+    # 每个数据块单独建草图再按顺序合并，与并行模式的结果完全相同
+    sketches = new_sketches(k) if sketches is None else sketches
+    idx = 0
+    with stage('clean.sketch', sketch_k=k) as m:
+        for file_path in tqdm(file_paths, desc='统计数值列分位数'):
+            columns = sketch_columns(ParquetFile(file_path))
+            m.add(bytes_read=os.path.getsize(file_path))
+            for chunk in m.timed(load_file_chunks(file_path, columns, chunksize, m) if columns else (), 'read_decode'):
+                with m.time('sketch'):
+                    merge_sketches(sketches, update_sketches(new_sketches(k, seed=idx * len(NUMERIC_COLS)), chunk))
+                m.add(rows_in=len(chunk))
+                idx += 1
+    return sketches
+
+def outlier_bounds(sketches):
+    bounds = {}
+    for col, sketch in sketches.items():
+        if sketch.n == 0:
+            continue
+        q1, q3 = (float(v) for v in sketch.quantiles([0.25, 0.75]))
+        iqr = q3 - q1
+        bounds[col] = {'q1': q1, 'q3': q3, 'lower': q1 - IQR_FACTOR * iqr, 'upper': q3 + IQR_FACTOR * iqr}
+    return bounds
+
+def drop_missing_and_outliers(chunk, stats, bounds):
+    before = len(chunk)
+    chunk = chunk.dropna(subset=['id', 'last_login', 'user_name', 'age', 'income'])
+    stats['missing_filled']['total'] += before - len(chunk)
+    # 合并为一个掩码只复制一次；被剔除的行计入第一个越界的列
+    keep = np.ones(len(chunk), dtype=bool)
+    for col in NUMERIC_COLS:
+        if col in chunk.columns and col in bounds:
+            inside = chunk[col].between(bounds[col]['lower'], bounds[col]['upper']).to_numpy(dtype=bool, na_value=False)
+            stats['outliers_removed'][col] += int((keep & ~inside).sum())
+            keep &= inside
+    return chunk[keep]
+
+def resolve_dedup_mode(dedup_mode, workers):
+    # 默认顺序执行用 bloom；并行模式按分区精确去重，不支持 bloom（否则重复数会随 --workers 改变）
+    parallel = bool(workers and workers > 1)
+    if dedup_mode is None:
+        return 'exact' if parallel else 'bloom'
+    if parallel and dedup_mode != 'exact':
+        raise ValueError(f"并行清洗只支持精确去重，不能使用 dedup_mode={dedup_mode}；请改用 exact 或 workers=1")
+    return dedup_mode
+
+def preprocess(parquet_dir, output_dir, columns_to_keep=None, dedup_mode=None, error_rate=0.0001,
+               workers=1, chunksize=CHUNKSIZE, incremental=False, sketch_k=SKETCH_K, writer=None):
+    # incremental=True 时只清洗清单中未记录的新文件，并沿用上次保存的去重过滤器，跨运行的重复记录同样会被剔除
+    dedup_mode = resolve_dedup_mode(dedup_mode, workers)
+    if columns_to_keep is None:
+        columns_to_keep = default_columns()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest()
+    files = list_parquet_files(parquet_dir)
+    if incremental:
+        # 已清洗过的文件变化或被删除时，去重过滤器与分位数草图中已含有其旧数据，无法回滚
+        stale = manifest.stale_files(CLEAN_STAGE, [os.path.join(parquet_dir, f) for f in files])
+        if stale:
+            raise ValueError(f"以下已清洗的输入文件已变化或被删除，去重状态无法回滚，请全量运行: {stale}")
+        files = [f for f in files if not manifest.is_processed(CLEAN_STAGE, os.path.join(parquet_dir, f))]
+        print(f"增量清洗: {len(files)} 个新文件")
+    else:
+        manifest.reset(CLEAN_STAGE, output_dir)
+    if workers and workers > 1:
+        if incremental:
+            raise ValueError("增量清洗需要逐块查询已保存的去重过滤器，请使用 workers=1")
+        sketch_chunksize = chunksize
+        if batching_settings['max_memory']:
+            chunksize = budget_chunksize(parquet_dir, columns_to_keep, batching_settings['max_memory'] / workers)
+            print(f"按内存预算确定的并行分块大小: {chunksize} 行")
+        return preprocess_parallel(parquet_dir, output_dir, columns_to_keep, workers, chunksize, manifest, sketch_k, writer,
+                                   sketch_chunksize)
+    restore = incremental and manifest.has_files(CLEAN_STAGE)
+    dedup_filter = load_state(DEDUP_STATE) if restore else None
+    if dedup_filter is None:
+        dedup_filter = DedupFilter(mode=dedup_mode, error_rate=error_rate)
+    stats = new_stats()
+    # 增量运行时把新文件并入已保存的草图，边界随累计数据更新（已写出的分块不再重算）
+    sketches = load_state(SKETCH_STATE) if restore else None
+    sketches = build_sketches([os.path.join(parquet_dir, f) for f in files], sketch_k, chunksize, sketches)
+    bounds = stats['outlier_bounds'] = outlier_bounds(sketches)
+    idx = manifest.next_index(CLEAN_STAGE)
+    # 写出交给后台线程，与下一个数据块的处理重叠；清单保存前等待全部写完
+    writes = AsyncWriter('write')
+    sizer = batch_sizer()
+    for file in tqdm(files, desc='处理文件列表'):
+        print(f"正在读取文件: {file}")
+        file_path = os.path.join(parquet_dir, file)
+        outputs = []
+        with stage('clean.file', file=file, bytes_read=os.path.getsize(file_path)) as file_metrics:
+            for chunk in file_metrics.timed(load_file_chunks(file_path, columns_to_keep, chunksize, file_metrics, sizer), 'read_decode'):
+                print(f"正在处理数据块 {idx}...")
+                with stage('clean.chunk', chunk=idx, file=file) as m:
+                    m.add(rows_in=len(chunk))
+                    if sizer is not None:
+                        sizer.observe(len(chunk), CLEAN_WORKING_SET * item_bytes(chunk))
+                        m.set(bytes_per_row=round(sizer.bytes_per_row, 1))
+                    chunk = chunk[[col for col in columns_to_keep if col in chunk.columns]]
+                    with m.time('hash'):
+                        h1, h2 = hash_keys(chunk, DEDUP_KEYS)
+                    with m.time('dedup_filter'):
+                        dup = dedup_filter.check_and_add(h1, h2)
+                    stats['duplicates_removed'] += int(dup.sum())
+                    chunk = chunk[~dup]
+                    with m.time('filter'):
+                        chunk = drop_missing_and_outliers(chunk, stats, bounds)
+                    with m.time('write'):
+                        writes.submit(save_clean_chunk, chunk, output_dir, idx, writer)
+                    m.add(rows_out=len(chunk))
+                file_metrics.add(rows_in=m.counters['rows_in'], rows_out=len(chunk))
+                outputs.append(f"clean_{idx}.parquet")
+                stats['chunks_processed'] += 1
+                idx += 1
+        manifest.record(CLEAN_STAGE, file_path, outputs, output_dir)
+    with stage('clean.write') as m:
+        m.add(bytes_written=sum(writes.close(m)))
+    manifest.set_next_index(CLEAN_STAGE, idx)
+    save_state(DEDUP_STATE, dedup_filter)
+    save_state(SKETCH_STATE, sketches)
+    manifest.save()
+    return stats
+
+# 并行模式分三个阶段：
+#   1. 每个数据块只读取去重键列，计算哈希并按 h1 % n_partitions 分区落盘；
+#   2. 每个分区由一个进程独占，按 (块号, 行号) 的全局顺序保留首次出现，得到各块的重复行号；
+#   3. 每个数据块读取全部列，剔除重复行后完成清洗并写出 clean_{idx}.parquet。
+# 草图阶段总是按 chunksize 切分，与顺序模式的草图完全相同，IQR 边界一致；去重为精确去重，保留的是全局首次出现的行。
+# 因此 duplicates_removed、missing_filled、outliers_removed 与 dedup_mode='exact' 的顺序运行相同。
+# 未设内存预算时清洗的分块边界也与顺序模式一致，chunks_processed 与 clean_{idx} 的编号相同；设了 --max-memory 时
+# 顺序模式按运行时的内存占用自适应切分，并行模式在开始前按预算一次确定分块大小，两者的分块数与分块边界不同。
+
+def sketch_chunk(idx, unit, k):
+    file_path, start, stop = unit
+    columns = sketch_columns(ParquetFile(file_path))
+    sketches = new_sketches(k, seed=idx * len(NUMERIC_COLS))
+    if not columns:
+        return sketches
+    with stage('clean.sketch_chunk', chunk=idx, rows_in=stop - start) as m:
+        with m.time('read_decode'):
+            chunk = read_chunk(file_path, start, stop, columns=columns)
+        with m.time('sketch'):
+            return update_sketches(sketches, chunk)
+
+def hash_partition_chunk(idx, unit, n_partitions, spill_dir):
+    file_path, start, stop = unit
+    with stage('clean.hash_chunk', chunk=idx, rows_in=stop - start) as m:
+        with m.time('read_decode'):
+            keys = read_chunk(file_path, start, stop, columns=DEDUP_KEYS)
+        with m.time('hash'):
+            h1, h2 = hash_keys(keys, DEDUP_KEYS)
+        rows = np.arange(len(h1), dtype=np.uint32)
+        parts = h1 % np.uint64(n_partitions)
+        with m.time('spill'):
+            for p in range(n_partitions):
+                sel = parts == p
+                np.savez(os.path.join(spill_dir, f"keys_{idx}_{p}.npz"), h1=h1[sel], h2=h2[sel], rows=rows[sel])
+
+def dedup_partition(p, n_chunks, spill_dir):
+    with stage('clean.dedup_partition', partition=p) as m:
+        loaded = [np.load(os.path.join(spill_dir, f"keys_{idx}_{p}.npz")) for idx in range(n_chunks)]
+        h1 = np.concatenate([d['h1'] for d in loaded])
+        h2 = np.concatenate([d['h2'] for d in loaded])
+        chunk_ids = np.concatenate([np.full(len(d['rows']), idx, dtype=np.uint32) for idx, d in enumerate(loaded)])
+        rows = np.concatenate([d['rows'] for d in loaded])
+        dup = ~first_occurrence(h1, h2)
+        m.add(rows_in=len(h1), rows_out=int((~dup).sum()))
+        dup_chunks, dup_rows = chunk_ids[dup], rows[dup]
+        bounds = np.searchsorted(dup_chunks, np.arange(n_chunks + 1, dtype=np.uint32))
+        for idx in range(n_chunks):
+            np.save(os.path.join(spill_dir, f"dups_{idx}_{p}.npy"), dup_rows[bounds[idx]:bounds[idx + 1]])
+        return h1[~dup], h2[~dup]
+
+def clean_chunk_worker(idx, unit, columns_to_keep, n_partitions, spill_dir, output_dir, bounds, writer=None):
+    file_path, start, stop = unit
+    stats = new_stats()
+    with stage('clean.chunk', chunk=idx, file=os.path.basename(file_path)) as m:
+        with m.time('read_decode'):
+            chunk = read_chunk(file_path, start, stop, columns=columns_to_keep)
+        m.add(rows_in=len(chunk))
         chunk = chunk[[col for col in columns_to_keep if col in chunk.columns]]
-        key_hash = (chunk['id'].astype(str) + '_' + chunk['last_login'].astype(str) + '_' + chunk['user_name'].astype(str)).apply(lambda x: sha256(x.encode()).hexdigest())
-        mask = key_hash.apply(lambda x: not dedup_filter.add(x))
-        stats['duplicates_removed'] += (~mask).sum()
-        chunk = chunk[mask]
-        before = len(chunk)
-        chunk = chunk.dropna(subset=['id', 'last_login', 'user_name', 'age', 'income'])
-        stats['missing_filled']['total'] += before - len(chunk)
-        for col in NUMERIC_COLS:
-            if col in chunk.columns:
-                q1 = chunk[col].quantile(0.25)
-                q3 = chunk[col].quantile(0.75)
-                iqr = q3 - q1
-                lower, upper = q1 - 1.5 * iqr, q3 + 1.5 * iqr
-                mask = (chunk[col] >= lower) & (chunk[col] <= upper)
-                stats['outliers_removed'][col] += (~mask).sum()
-                chunk = chunk[mask]
-        save_clean_chunk(chunk, output_dir, idx)
-        stats['chunks_processed'] += 1
+        dup = np.zeros(len(chunk), dtype=bool)
+        for p in range(n_partitions):
+            dup[np.load(os.path.join(spill_dir, f"dups_{idx}_{p}.npy"))] = True
+        stats['duplicates_removed'] += int(dup.sum())
+        chunk = chunk[~dup]
+        with m.time('filter'):
+            chunk = drop_missing_and_outliers(chunk, stats, bounds)
+        with m.time('write'):
+            m.add(bytes_written=save_clean_chunk(chunk, output_dir, idx, writer))
+        m.add(rows_out=len(chunk))
+    stats['chunks_processed'] += 1
+    return stats
+
+def budget_chunksize(parquet_dir, columns, budget):
+    # 并行模式的分块在开始前一次确定：按最宽文件的元数据估计每行大小，预算平均分给各进程
+    sizer = BatchSizer(budget)
+    for file in list_parquet_files(parquet_dir):
+        pf = ParquetFile(os.path.join(parquet_dir, file))
+        per_row = metadata_bytes_per_row(pf.metadata, resolve_columns(pf, columns)[0]) * PRIOR_FACTOR * CLEAN_WORKING_SET
+        sizer.bytes_per_row = max(sizer.bytes_per_row or 1.0, per_row)
+    return sizer.rows()
+
+def preprocess_parallel(parquet_dir, output_dir, columns_to_keep, workers, chunksize=CHUNKSIZE, manifest=None,
+                        sketch_k=SKETCH_K, writer=None, sketch_chunksize=None):
+    manifest = Manifest() if manifest is None else manifest
+    units = plan_chunks(parquet_dir, chunksize)
+    n_chunks = len(units)
+    sketch_units = plan_chunks(parquet_dir, sketch_chunksize or chunksize)
+    n_partitions = workers * 4
+    stats = new_stats()
+    with tempfile.TemporaryDirectory(dir=output_dir) as spill_dir, ProcessPoolExecutor(max_workers=workers) as pool:
+        print(f"并行清洗: {n_chunks} 个数据块, {workers} 个进程, {n_partitions} 个去重分区")
+        sketches = new_sketches(sketch_k)
+        for part in pool.map(sketch_chunk, range(len(sketch_units)), sketch_units, [sketch_k] * len(sketch_units)):
+            merge_sketches(sketches, part)
+        bounds = stats['outlier_bounds'] = outlier_bounds(sketches)
+        list(pool.map(hash_partition_chunk, range(n_chunks), units,
+                      [n_partitions] * n_chunks, [spill_dir] * n_chunks))
+        partition_keys = list(pool.map(dedup_partition, range(n_partitions),
+                                       [n_chunks] * n_partitions, [spill_dir] * n_partitions))
+        results = pool.map(clean_chunk_worker, range(n_chunks), units, [columns_to_keep] * n_chunks,
+                           [n_partitions] * n_chunks, [spill_dir] * n_chunks, [output_dir] * n_chunks,
+                           [bounds] * n_chunks, [writer] * n_chunks)
+        for part in tqdm(results, total=n_chunks, desc='并行清洗数据块'):
+            merge_stats(stats, part)
+    # 各分区的键互不相交，合并后即为精确去重集合，供之后的增量运行使用
+    dedup_filter = DedupFilter(mode='exact')
+    if partition_keys:
+        dedup_filter.seen.add(np.concatenate([h1 for h1, _ in partition_keys]),
+                              np.concatenate([h2 for _, h2 in partition_keys]))
+    outputs = defaultdict(list)
+    for idx, (file_path, _, _) in enumerate(units):
+        outputs[file_path].append(f"clean_{idx}.parquet")
+    for file in list_parquet_files(parquet_dir):
+        file_path = os.path.join(parquet_dir, file)
+        manifest.record(CLEAN_STAGE, file_path, outputs[file_path], output_dir)
+    manifest.set_next_index(CLEAN_STAGE, n_chunks)
+    save_state(DEDUP_STATE, dedup_filter)
+    save_state(SKETCH_STATE, sketches)
+    manifest.save()
     return stats
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='清洗并去重原始 parquet 数据')
+    parser.add_argument('--workers', type=int, default=1, help='并行进程数，1 表示顺序执行')
+    parser.add_argument('--dedup-mode', choices=['bloom', 'exact'], help='默认顺序执行时为 bloom，并行（--workers > 1）时为 exact')
+    parser.add_argument('--incremental', action='store_true', help='只清洗新增的输入文件')
+    parser.add_argument('--sketch-k', type=int, default=SKETCH_K, help='分位数草图大小，越大 IQR 边界越精确')
+    add_writer_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_memory_argument(parser)
+    args = parser.parse_args()
+    configure_prefetch(args)
+    configure_batching(args)
+    try:
+        dedup_mode = resolve_dedup_mode(args.dedup_mode, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
     start_time = time.time()
-    stats = preprocess(INPUT_DIR, OUTPUT_DIR)
+    with stage('clean', workers=args.workers, dedup_mode=dedup_mode, incremental=args.incremental) as m:
+        stats = preprocess(INPUT_DIR, OUTPUT_DIR, dedup_mode=dedup_mode, workers=args.workers,
+                           incremental=args.incremental, sketch_k=args.sketch_k, writer=writer_from_args(args))
+        m.set(stats=stats)
     elapsed = time.time() - start_time
     print("清洗完成！")
     print(json.dumps(stats, indent=2, ensure_ascii=False, default=str))
-    with open(LOG_FILE, 'w', encoding='utf-8') as f:
-        f.write(f"运行时间: {elapsed:.2f} 秒\n")
-        f.write(json.dumps(stats, indent=2, ensure_ascii=False, default=str))
-    print(f"总耗时: {elapsed:.2f} 秒，日志已保存至 {LOG_FILE}")
+    print(f"总耗时: {elapsed:.2f} 秒，运行指标已追加至 {METRICS_PATH}")
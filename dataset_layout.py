@@ -0,0 +1,192 @@
+import os
+import json
+import shutil
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# expanded_items 的 hive 分区布局：<目录>/year=2021/quarter=3/item_category=电子产品/part-<批次>-<i>.parquet
+# 分区列只出现在目录名中（非 ASCII 值按 URI 编码），数据文件里不再重复存储。
+# 根目录下另有两个汇总文件：
+#   _common_metadata —— 完整 schema（含分区列及其类型），schema 元数据 partitioning 记录分区列名
+#   _metadata —— 所有数据文件的行组元数据（路径相对于根目录），可据此查看统计信息而不必逐个打开文件
+PARTITION_SCHEMA = pa.schema([('year', pa.int16()), ('quarter', pa.int8()), ('item_category', pa.string())])
+METADATA_FILE = '_metadata'
+COMMON_METADATA_FILE = '_common_metadata'
+TARGET_FILE_MB = 128
+
+def is_partitioned(directory):
+    if os.path.exists(os.path.join(directory, COMMON_METADATA_FILE)):
+        return True
+    return os.path.isdir(directory) and any('=' in entry and os.path.isdir(os.path.join(directory, entry))
+                                            for entry in os.listdir(directory))
+
+def clear_dataset(directory):
+    # 全量重写前清掉两种布局留下的旧输出，避免新旧文件混在一起被读取
+    if not os.path.isdir(directory):
+        return
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path) and '=' in entry:
+            shutil.rmtree(path)
+        elif entry.endswith('.parquet') or entry in (METADATA_FILE, COMMON_METADATA_FILE):
+            os.remove(path)
+
+def add_partition_columns(table):
+    # 取 purchase_date 的前 10 个字符解析为日期；无法解析的日期写入 __HIVE_DEFAULT_PARTITION__ 分区
+    dates = pc.strptime(pc.utf8_slice_codeunits(table.column('purchase_date'), 0, 10),
+                        format='%Y-%m-%d', unit='s', error_is_null=True)
+    category = pc.cast(table.column('item_category'), pa.string())
+    table = table.set_column(table.schema.get_field_index('item_category'), 'item_category', category)
+    return (table.append_column('year', pc.cast(pc.year(dates), pa.int16()))
+                 .append_column('quarter', pc.cast(pc.quarter(dates), pa.int8())))
+
+def logical_schema(table):
+    # 读取时的 schema：品类分区列按字典类型解析，与平铺布局中的列类型保持一致
+    fields = [table.schema.field(name) for name in table.column_names if name not in PARTITION_SCHEMA.names]
+    fields += [pa.field('year', pa.int16()), pa.field('quarter', pa.int8()),
+               pa.field('item_category', pa.dictionary(pa.int32(), pa.string()))]
+    return pa.schema(fields, metadata={b'partitioning': json.dumps(PARTITION_SCHEMA.names).encode()})
+
+def split_partitions(table):
+    # 按分区列稳定排序后切成连续的段，返回 [(分区键, 该分区的行)]；空值（无法解析的日期或品类）自成一段。
+    # 每段用 take 复制出独立的缓冲区，缓存某个分区时不会连带占住整个批次
+    order = pc.sort_indices(table, sort_keys=[(name, 'ascending') for name in PARTITION_SCHEMA.names]).to_numpy()
+    codes = [pc.fill_null(table.column('year'), -1).to_numpy(),
+             pc.fill_null(table.column('quarter'), -1).to_numpy(),
+             pc.fill_null(table.column('item_category').combine_chunks().dictionary_encode().indices, -1).to_numpy()]
+    changed = np.zeros(max(table.num_rows - 1, 0), dtype=bool)
+    for code in codes:
+        code = code[order]
+        changed |= code[1:] != code[:-1]
+    bounds = np.concatenate([[0], np.flatnonzero(changed) + 1, [table.num_rows]]) if table.num_rows else [0]
+    parts = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        part = table.take(order[start:end])
+        parts.append((tuple(part.column(name)[0].as_py() for name in PARTITION_SCHEMA.names), part))
+    return parts
+
+class PartitionBuffer:
+    # 按分区缓存跨批次、跨输入文件的行，攒满整文件（rows_per_file 的整数倍）才交给写出，
+    # 避免每个批次或每个输入文件在每个分区下各写一个小文件。每段行带有来源标记（输入文件），
+    # 写出时一并返回这些行的来源，供清单记录哪些输入共用了哪些产出文件。
+    # 缓存超过 max_bytes 时先写出缓存最多的分区（不足整文件），直到降到 max_bytes 的一半
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.parts = {}
+        self.nbytes = 0
+
+    def add(self, table, rows_per_file, source=None):
+        # table 为不含分区列的新批次；返回 (可以写出的行（含分区列）或 None, 这些行的来源集合)
+        for key, part in split_partitions(add_partition_columns(table)):
+            self.parts.setdefault(key, []).append((source, part))
+            self.nbytes += part.nbytes
+        ready, sources = [], set()
+        for key in list(self.parts):
+            rows = sum(part.num_rows for _, part in self.parts[key])
+            if rows >= rows_per_file:
+                self.take(key, rows // rows_per_file * rows_per_file, ready, sources)
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            for key in sorted(self.parts, key=lambda k: -sum(part.nbytes for _, part in self.parts[k])):
+                if self.nbytes <= self.max_bytes / 2:
+                    break
+                self.take(key, None, ready, sources)
+        return (pa.concat_tables(ready) if ready else None), sources
+
+    def take(self, key, rows, ready, sources):
+        # 取出该分区最早缓存的 rows 行（None 表示全部）
+        taken, kept = [], []
+        for source, part in self.parts.pop(key):
+            n = part.num_rows if rows is None else min(part.num_rows, rows)
+            if n:
+                taken.append(part.slice(0, n))
+                sources.add(source)
+            if n < part.num_rows:
+                kept.append((source, part.slice(n)))
+            if rows is not None:
+                rows -= n
+        if kept:
+            self.parts[key] = kept
+        self.nbytes -= sum(part.nbytes for part in taken)
+        ready.append(pa.concat_tables(taken))
+
+    def flush(self):
+        # 取出缓存中剩余的全部行，返回值同 add
+        ready, sources = [], set()
+        for key in list(self.parts):
+            self.take(key, None, ready, sources)
+        self.nbytes = 0
+        return (pa.concat_tables(ready) if ready else None), sources
+
+def write_partitioned(table, directory, batch_id, writer, rows_per_file):
+    # table 已含分区列（见 PartitionBuffer）；每个分区内按 rows_per_file 切分文件，
+    # 返回写出的文件（WrittenFile：path 与 parquet 元数据）
+    table = writer.prepare(table)
+    written = []
+    ds.write_dataset(table, directory, format='parquet',
+                     partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'),
+                     basename_template=f"part-{batch_id}-{{i}}.parquet",
+                     existing_data_behavior='overwrite_or_ignore',
+                     file_options=writer.dataset_options(table.drop_columns(PARTITION_SCHEMA.names)),
+                     max_rows_per_file=rows_per_file,
+                     max_rows_per_group=min(rows_per_file, writer.row_group_size),
+                     file_visitor=written.append)
+    return written
+
+def write_summary(directory, schema, written, append=False):
+    # 增量运行时把新文件的行组追加到已有的 _metadata 之后
+    pq.write_metadata(schema, os.path.join(directory, COMMON_METADATA_FILE))
+    metadata_path = os.path.join(directory, METADATA_FILE)
+    summary = pq.read_metadata(metadata_path) if append and os.path.exists(metadata_path) else None
+    for written_file in written:
+        written_file.metadata.set_file_path(os.path.relpath(written_file.path, directory).replace(os.sep, '/'))
+        if summary is None:
+            summary = written_file.metadata
+        else:
+            summary.append_row_groups(written_file.metadata)
+    if summary is not None:
+        summary.write_metadata_file(metadata_path)
+
+def rebuild_summary(directory, schema=None):
+    # 从目录中现有的数据文件重新生成汇总文件；schema 为 None 时沿用已有的 _common_metadata
+    common = os.path.join(directory, COMMON_METADATA_FILE)
+    schema = pq.read_schema(common) if schema is None and os.path.exists(common) else schema
+    if schema is not None:
+        pq.write_metadata(schema, common)
+    summary = None
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(f for f in files if f.endswith('.parquet')):
+            path = os.path.join(root, name)
+            metadata = pq.read_metadata(path)
+            metadata.set_file_path(os.path.relpath(path, directory).replace(os.sep, '/'))
+            if summary is None:
+                summary = metadata
+            else:
+                summary.append_row_groups(metadata)
+    metadata_path = os.path.join(directory, METADATA_FILE)
+    if summary is not None:
+        summary.write_metadata_file(metadata_path)
+    elif os.path.exists(metadata_path):
+        os.remove(metadata_path)
+
+def partitioning(directory):
+    common = os.path.join(directory, COMMON_METADATA_FILE)
+    if os.path.exists(common):
+        schema = pq.read_schema(common)
+        names = json.loads(schema.metadata[b'partitioning'])
+        return ds.HivePartitioning.discover(schema=pa.schema([schema.field(name) for name in names]))
+    # 没有汇总文件时从目录名推断分区列，字符串分区值按字典类型解析
+    return ds.HivePartitioning.discover(infer_dictionary=True)
+
+def open_dataset(directory):
+    # 两种布局统一为 pyarrow.dataset：平铺布局是按文件名排序的 .parquet 列表，分区布局自动发现分区列
+    if is_partitioned(directory):
+        return ds.dataset(directory, format='parquet', partitioning=partitioning(directory))
+    files = sorted(f for f in os.listdir(directory) if f.endswith('.parquet')) if os.path.isdir(directory) else []
+    return ds.dataset([os.path.join(directory, f) for f in files], format='parquet')
+
+def partition_names(dataset):
+    return list(dataset.partitioning.schema.names) if getattr(dataset, 'partitioning', None) is not None else []
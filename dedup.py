@@ -0,0 +1,137 @@
+import math
+import numpy as np
+import pandas as pd
+
+DEDUP_KEYS = ['id', 'last_login', 'user_name']
+# 两个独立的 hash_key，分别生成 128 位键的高低 64 位
+HASH_KEY_1 = '0123456789123456'
+HASH_KEY_2 = 'f1e2d3c4b5a69788'
+PROBE_BATCH = 262_144
+
+def hash_keys(df, columns=DEDUP_KEYS):
+    # 按列向量化计算 64 位哈希并组合成行哈希，返回 (h1, h2) 两个 uint64 数组
+    keys = df[columns]
+    h1 = pd.util.hash_pandas_object(keys, index=False, hash_key=HASH_KEY_1).to_numpy(dtype=np.uint64)
+    h2 = pd.util.hash_pandas_object(keys, index=False, hash_key=HASH_KEY_2).to_numpy(dtype=np.uint64)
+    return h1, h2
+
+def first_occurrence(h1, h2):
+    # 批内去重：同一批次中第二次及以后出现的键视为重复
+    return ~pd.DataFrame({'h1': h1, 'h2': h2}).duplicated().to_numpy()
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = int(capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, h1, h2):
+        # 双重哈希: pos_i = h1 + i * h2 (mod m)
+        i = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1[:, None] + i[None, :] * (h2[:, None] | np.uint64(1))) % np.uint64(self.num_bits)
+
+    def contains(self, h1, h2):
+        result = np.empty(len(h1), dtype=bool)
+        for start in range(0, len(h1), PROBE_BATCH):
+            pos = self._positions(h1[start:start + PROBE_BATCH], h2[start:start + PROBE_BATCH])
+            bits = (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+            result[start:start + PROBE_BATCH] = bits.all(axis=1)
+        return result
+
+    def add(self, h1, h2):
+        for start in range(0, len(h1), PROBE_BATCH):
+            pos = self._positions(h1[start:start + PROBE_BATCH], h2[start:start + PROBE_BATCH]).ravel()
+            values = np.left_shift(np.uint8(1), (pos & np.uint64(7)).astype(np.uint8))
+            np.bitwise_or.at(self.bits, pos >> np.uint64(3), values)
+        self.count += len(h1)
+
+class ScalableBloomFilter:
+    def __init__(self, error_rate=0.001, initial_capacity=1_000_000, growth=4, tightening_ratio=0.9):
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.growth = growth
+        self.tightening_ratio = tightening_ratio
+        self.filters = []
+
+    def contains(self, h1, h2):
+        result = np.zeros(len(h1), dtype=bool)
+        for bf in self.filters:
+            todo = ~result
+            if not todo.any():
+                break
+            result[todo] = bf.contains(h1[todo], h2[todo])
+        return result
+
+    def add(self, h1, h2):
+        start = 0
+        while start < len(h1):
+            if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+                n = len(self.filters)
+                self.filters.append(BloomFilter(
+                    self.initial_capacity * self.growth ** n,
+                    self.error_rate * (1 - self.tightening_ratio) * self.tightening_ratio ** n
+                ))
+            bf = self.filters[-1]
+            take = min(bf.capacity - bf.count, len(h1) - start)
+            bf.add(h1[start:start + take], h2[start:start + take])
+            start += take
+
+def unique_pairs(h1, h2):
+    # 按 (h1, h2) 字典序排序并去掉重复的键对
+    order = np.lexsort((h2, h1))
+    h1, h2 = h1[order], h2[order]
+    keep = np.ones(len(h1), dtype=bool)
+    keep[1:] = (h1[1:] != h1[:-1]) | (h2[1:] != h2[:-1])
+    return h1[keep], h2[keep]
+
+class SortedKeySet:
+    # 精确模式：以若干按 (h1, h2) 排序的段保存已见键的完整 128 位哈希（对数归并），
+    # 按批在 h1 上 searchsorted，再比较 h2；与批内去重和并行模式使用同样的键
+    def __init__(self):
+        self.runs = []
+
+    def contains(self, h1, h2):
+        result = np.zeros(len(h1), dtype=bool)
+        for run_h1, run_h2 in self.runs:
+            lo = np.searchsorted(run_h1, h1, side='left')
+            hi = np.searchsorted(run_h1, h1, side='right')
+            single = np.flatnonzero(hi - lo == 1)
+            result[single] |= run_h2[lo[single]] == h2[single]
+            # 同一 h1 对应多个 h2（64 位哈希碰撞）时在该区间内查找
+            for i in np.flatnonzero(hi - lo > 1):
+                result[i] |= bool((run_h2[lo[i]:hi[i]] == h2[i]).any())
+        return result
+
+    def add(self, h1, h2):
+        if len(h1) == 0:
+            return
+        self.runs.append(unique_pairs(h1, h2))
+        while len(self.runs) > 1 and len(self.runs[-1][0]) * 2 >= len(self.runs[-2][0]):
+            last_h1, last_h2 = self.runs.pop()
+            run_h1, run_h2 = self.runs[-1]
+            self.runs[-1] = unique_pairs(np.concatenate([run_h1, last_h1]), np.concatenate([run_h2, last_h2]))
+
+class DedupFilter:
+    def __init__(self, mode='bloom', error_rate=0.0001, initial_capacity=1_000_000):
+        if mode == 'bloom':
+            self.seen = ScalableBloomFilter(error_rate=error_rate, initial_capacity=initial_capacity)
+        elif mode == 'exact':
+            self.seen = SortedKeySet()
+        else:
+            raise ValueError(f"未知的去重模式: {mode}（可选 'bloom' 或 'exact'）")
+        self.mode = mode
+
+    def check_and_add(self, h1, h2):
+        # 返回布尔数组，True 表示该行的键此前（包括本批更早的行）已出现过
+        first = first_occurrence(h1, h2)
+        dup = ~first
+        if len(h1) == 0:
+            return dup
+        new_h1, new_h2 = h1[first], h2[first]
+        seen = self.seen.contains(new_h1, new_h2)
+        dup[np.flatnonzero(first)[seen]] = True
+        self.seen.add(new_h1[~seen], new_h2[~seen])
+        return dup
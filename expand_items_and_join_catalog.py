@@ -1,85 +1,209 @@
 import os
-import json
-import pandas as pd
+import ast
+import argparse
+import pyarrow as pa
+import pyarrow.compute as pc
 from pyarrow.parquet import ParquetFile
 from tqdm import tqdm
-import ast
+from product_catalog import get_catalog
+from manifest import Manifest
+from metrics import stage
+from parquet_writer import ParquetOutput, add_writer_arguments, writer_from_args
+from prefetch import prefetch, AsyncWriter, add_prefetch_arguments, configure as configure_prefetch
+from batching import (batch_sizer, UNIT_ROWS, add_memory_argument, configure as configure_batching,
+                      settings as batching_settings)
+from dataset_layout import (TARGET_FILE_MB, PartitionBuffer, is_partitioned, clear_dataset, logical_schema,
+                            write_partitioned, write_summary, rebuild_summary)
 
-INPUT_DIR = './outputs/cleaned_chunks'  
-OUTPUT_DIR = './outputs/expanded_items_chunks'  
-PRODUCT_CATALOG_PATH = './product_catalog.json'
+INPUT_DIR = './outputs/cleaned_chunks'
+OUTPUT_DIR = './outputs/expanded_items_chunks'
 CHUNKSIZE = 5_000_000
+REQUIRED_COLS = ['id', 'purchase_item_ids', 'purchase_date', 'payment_method', 'payment_status']
+ITEM_LIST_TYPE = pa.list_(pa.struct([('id', pa.int64())]))
+HIGH_VALUE_PRICE = 5000
+EXPAND_STAGE = 'expand'
+# 分区布局下跨批次缓存的行最多占内存预算（--max-memory）的比例；未设预算时的上限
+PARTITION_BUFFER_SHARE = 0.25
+PARTITION_BUFFER_BYTES = 2 * 2**30
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-with open(PRODUCT_CATALOG_PATH, 'r', encoding='utf-8') as f:
-    raw_catalog = json.load(f)
-    product_catalog = {
-        str(p['id']): {
-            'category': p['category'],
-            'price': p['price']
-        } for p in raw_catalog['products']
-    }
+def parse_item_strings(column):
+    # 兼容旧版清洗输出中以字符串保存的 items 列表
+    parsed = []
+    for value in column.to_pylist():
+        try:
+            items = ast.literal_eval(value) if value else []
+            parsed.append([{'id': item.get('id')} for item in items])
+        except Exception:
+            parsed.append([])
+    return pa.array(parsed, type=ITEM_LIST_TYPE)
 
-def extract_items(row):
-    try:
-        items = row['purchase_item_ids']
-        if isinstance(items, str):
-            items = ast.literal_eval(items)
-        if not isinstance(items, list):
-            if hasattr(items, '__iter__'):
-                items = list(items)
-            else:
-                return []
-        if not items:
-            return []
+def explode_items(batch, catalog):
+    items = batch.column('purchase_item_ids')
+    if pa.types.is_string(items.type) or pa.types.is_large_string(items.type):
+        items = parse_item_strings(items)
+    flat = pc.list_flatten(items)
+    parents = pc.list_parent_indices(items)
+    valid = pc.is_valid(flat)
+    flat, parents = pc.filter(flat, valid), pc.filter(parents, valid)
+    raw_ids = pc.struct_field(flat, 'id')
+    item_ids = pc.fill_null(pc.cast(raw_ids, pa.string()), 'None')
+    category, price = catalog.lookup(raw_ids)
+
+    def take_column(name):
+        if name in batch.schema.names:
+            return pc.take(batch.column(name), parents)
+        return pa.nulls(len(parents), type=pa.string())
 
-        result = []
-        for item in items:
-            item_id = str(item.get('id'))
-            info = product_catalog.get(item_id, {})
-            result.append({
-                'user_id': row['id'],
-                'purchase_date': row.get('purchase_date'),
-                'item_id': item_id,
-                'item_category': info.get('category', '未知'),
-                'item_price': info.get('price', -1),
-                'payment_method': row.get('payment_method'),
-                'payment_status': row.get('payment_status'),
-                'is_high_value': info.get('price', 0) > 5000
-            })
-        return result
-    except Exception:
-        return []
+    return pa.table({
+        'user_id': take_column('id'),
+        'purchase_date': take_column('purchase_date'),
+        'item_id': item_ids,
+        'item_category': category,
+        'item_price': price,
+        'payment_method': take_column('payment_method'),
+        'payment_status': take_column('payment_status'),
+        'is_high_value': price > HIGH_VALUE_PRICE
+    })
 
-preview_checked = False
-batch_counter = 0
+def rows_per_file(totals, table, target_file_mb):
+    # 按已写出文件的实际字节数/行数估计每个文件的行数；尚未写出时用内存中的大小估计
+    bytes_per_row = totals['bytes'] / totals['rows'] if totals['rows'] else table.nbytes / table.num_rows
+    return max(1, int(target_file_mb * 2**20 / max(bytes_per_row, 1e-9)))
 
-parquet_files = sorted([f for f in os.listdir(INPUT_DIR) if f.endswith('.parquet')])
+def write_partition_batch(table, batch_id, writer, rows_per_file, output_lists, totals):
+    # 在写出线程中执行：写出的文件记入每个来源输入的产出列表，并累计字节数，供后续批次估计每个文件的行数
+    files = write_partitioned(table, OUTPUT_DIR, batch_id, writer, rows_per_file)
+    for outputs in output_lists:
+        outputs.extend(os.path.relpath(f.path, OUTPUT_DIR) for f in files)
+    totals['bytes'] += sum(os.path.getsize(f.path) for f in files)
+    totals['rows'] += table.num_rows
+    return files
 
-for filename in tqdm(parquet_files, desc='展开 items 文件级处理'):
-    file_path = os.path.join(INPUT_DIR, filename)
-    pf = ParquetFile(file_path)
-    for batch_idx, batch in enumerate(pf.iter_batches(batch_size=CHUNKSIZE)):
-        print(f"正在处理文件: {filename}, 分块批次: {batch_idx}")
-        df = batch.to_pandas()
-        required_cols = ['id', 'purchase_item_ids', 'purchase_date', 'payment_method', 'payment_status']
-        df = df[[col for col in required_cols if col in df.columns]]
-        exploded = df.apply(extract_items, axis=1).explode().dropna()
+def main(incremental=False, writer=None, partitioned=False, target_file_mb=TARGET_FILE_MB):
+    writer = ParquetOutput() if writer is None else writer
+    with stage('expand.catalog_load') as m:
+        catalog = get_catalog()
+        m.add(rows_out=len(catalog))
+    manifest = Manifest()
+    preview_checked = False
 
-        if not preview_checked:
-            preview_checked = True
-            if exploded.empty:
-                raise ValueError(f"数据展开失败：首批数据无有效商品，请检查清洗后的字段格式！\n示例行：\n{df.head(3)}")
+    parquet_files = sorted([f for f in os.listdir(INPUT_DIR) if f.endswith('.parquet')])
+    if incremental and manifest.has_files(EXPAND_STAGE) and is_partitioned(OUTPUT_DIR) != partitioned:
+        raise ValueError("增量展开必须沿用已有输出的布局（平铺 / 分区），切换布局请先全量运行")
+    removed = []
+    if incremental and not manifest.has_files(EXPAND_STAGE):
+        # 清单为空（首次运行或上游清洗已全量重跑）时，目录中残留的输出都已过期
+        clear_dataset(OUTPUT_DIR)
+    if incremental:
+        # 只展开清单中未记录的清洗分块，批次编号接着上次继续；内容变化或被删除的清洗分块先删除其旧输出
+        for path in manifest.stale_files(EXPAND_STAGE, [os.path.join(INPUT_DIR, f) for f in parquet_files]):
+            removed += manifest.discard(EXPAND_STAGE, path)
+            print(f"清洗分块已变化或被删除，删除其旧输出后重新展开: {path}")
+        parquet_files = [f for f in parquet_files if not manifest.is_processed(EXPAND_STAGE, os.path.join(INPUT_DIR, f))]
+        print(f"增量展开: {len(parquet_files)} 个待展开的清洗分块")
+    else:
+        manifest.reset(EXPAND_STAGE, OUTPUT_DIR)
+        clear_dataset(OUTPUT_DIR)
+    first_batch = batch_counter = manifest.next_index(EXPAND_STAGE)
+    # 分区布局：各分区的行跨批次、跨清洗分块缓存，攒够 target_file_mb 大小的整文件再写出，剩余的行在最后写出。
+    # 一个输出文件可能含多个清洗分块的行，清单中这些分块都记录该文件；其中任一分块变化时，
+    # 共用文件的分块一并删除产出、重新展开（见 Manifest.discard）
+    totals, summary_schema = {'bytes': 0, 'rows': 0}, None
+    budget = batching_settings['max_memory']
+    buffer = PartitionBuffer(budget * PARTITION_BUFFER_SHARE if budget else PARTITION_BUFFER_BYTES)
+    outputs_of = {}
+    # 读取与写出都在后台线程进行；各文件的输出在全部写完后再记入清单
+    writes = AsyncWriter('write')
+    records = []
+    sizer = batch_sizer()
+
+    for filename in tqdm(parquet_files, desc='展开 items 文件级处理'):
+        file_path = os.path.join(INPUT_DIR, filename)
+        outputs = outputs_of[file_path] = []
+        pf = ParquetFile(file_path)
+        columns = [col for col in REQUIRED_COLS if col in pf.schema_arrow.names]
+        with stage('expand.file', file=filename, bytes_read=os.path.getsize(file_path)) as file_metrics:
+            if sizer is None:
+                batches = pf.iter_batches(batch_size=CHUNKSIZE, columns=columns)
             else:
-                print("首批数据通过，继续处理...")
+                # 按内存预算切分：每行的工作集包括输入批次和展开后的商品表，由实际展开结果修正
+                sizer.prime(pf.metadata, columns)
+                batches = sizer.split_batches(pf.iter_batches(batch_size=UNIT_ROWS, columns=columns))
+            batches = file_metrics.timed(prefetch(batches, 'prefetch', file_metrics), 'read_decode')
+            for batch_idx, batch in enumerate(batches):
+                print(f"正在处理文件: {filename}, 分块批次: {batch_idx}")
+                with stage('expand.batch', file=filename, batch=batch_idx) as m:
+                    with m.time('explode_join'):
+                        exploded = explode_items(batch, catalog)
+                    m.add(rows_in=batch.num_rows, rows_out=exploded.num_rows)
+                    if sizer is not None:
+                        sizer.observe(batch.num_rows, batch.nbytes + exploded.nbytes)
+                        m.set(bytes_per_row=round(sizer.bytes_per_row, 1))
+
+                    if not preview_checked:
+                        preview_checked = True
+                        if exploded.num_rows == 0:
+                            raise ValueError(f"数据展开失败：首批数据无有效商品，请检查清洗后的字段格式！\n示例行：\n{batch.slice(0, 3).to_pandas()}")
+                        else:
+                            print("首批数据通过，继续处理...")
+
+                    if exploded.num_rows > 0 and partitioned:
+                        file_rows = rows_per_file(totals, exploded, target_file_mb)
+                        ready, sources = buffer.add(exploded, file_rows, file_path)
+                        summary_schema = summary_schema or logical_schema(exploded)
+                        if ready is not None:
+                            with m.time('write'):
+                                writes.submit(write_partition_batch, ready, batch_counter, writer, file_rows,
+                                              [outputs_of[source] for source in sorted(sources)], totals, size=ready.nbytes)
+                            print(f"已提交批次 {batch_counter}，记录数: {ready.num_rows} → 分区目录")
+                            batch_counter += 1
+                        else:
+                            print(f"已缓存 {exploded.num_rows} 条记录，等待攒满分区文件")
+                    elif exploded.num_rows > 0:
+                        output_path = os.path.join(OUTPUT_DIR, f"expanded_items_batch_{batch_counter}.parquet")
+                        with m.time('write'):
+                            writes.submit(writer.write, exploded, output_path, size=exploded.nbytes)
+                        m.set(output=os.path.basename(output_path))
+                        print(f"已提交批次 {batch_counter}，记录数: {exploded.num_rows} → {output_path}")
+                        outputs.append(os.path.basename(output_path))
+                        batch_counter += 1
+                    else:
+                        print(f"跳过空批次: {filename}, 分块 {batch_idx}")
+                file_metrics.add(rows_in=batch.num_rows, rows_out=exploded.num_rows)
+        records.append((file_path, outputs))
 
-        if not exploded.empty:
-            normalized = pd.json_normalize(exploded)
-            output_path = os.path.join(OUTPUT_DIR, f"expanded_items_batch_{batch_counter}.parquet")
-            normalized.to_parquet(output_path, index=False)
-            print(f"已保存批次 {batch_counter}，记录数: {len(normalized)} → {output_path}")
+    with stage('expand.write') as m:
+        rest, sources = buffer.flush()
+        if rest is not None:
+            writes.submit(write_partition_batch, rest, batch_counter, writer, rows_per_file(totals, rest, target_file_mb),
+                          [outputs_of[source] for source in sorted(sources)], totals, size=rest.nbytes)
+            print(f"已提交批次 {batch_counter}，记录数: {rest.num_rows} → 分区目录（缓存中的剩余记录）")
             batch_counter += 1
-        else:
-            print(f"跳过空批次: {filename}, 分块 {batch_idx}")
+        results = writes.close(m)
+        m.add(bytes_written=totals['bytes'] if partitioned else sum(results))
+    for file_path, outputs in records:
+        manifest.record(EXPAND_STAGE, file_path, outputs, OUTPUT_DIR)
+    if partitioned and removed:
+        # 有旧文件被删除时 _metadata 不能只追加，从现有数据文件重新汇总
+        rebuild_summary(OUTPUT_DIR, summary_schema)
+    elif summary_schema is not None:
+        write_summary(OUTPUT_DIR, summary_schema, [f for files in results for f in files], append=incremental)
+    manifest.set_next_index(EXPAND_STAGE, batch_counter)
+    manifest.save()
+    print(f"全部处理完成，共生成 {batch_counter - first_batch} 个 expanded_items 批次文件，存储于: {OUTPUT_DIR}")
 
-print(f"全部处理完成，共生成 {batch_counter} 个 expanded_items 批次文件，存储于: {OUTPUT_DIR}")
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='展开 items 并关联商品目录')
+    parser.add_argument('--incremental', action='store_true', help='只展开新增的清洗分块')
+    parser.add_argument('--partitioned', action='store_true', help='按 year/quarter/item_category 写出 hive 分区数据集')
+    parser.add_argument('--target-file-mb', type=float, default=TARGET_FILE_MB, help='分区布局下单个文件的目标大小（MiB）')
+    add_writer_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_memory_argument(parser)
+    args = parser.parse_args()
+    configure_prefetch(args)
+    configure_batching(args)
+    with stage('expand', incremental=args.incremental, partitioned=args.partitioned):
+        main(incremental=args.incremental, writer=writer_from_args(args),
+             partitioned=args.partitioned, target_file_mb=args.target_file_mb)
@@ -0,0 +1,158 @@
+import os
+import json
+import pickle
+import hashlib
+
+MANIFEST_PATH = './outputs/manifest.json'
+STATE_DIR = './outputs/state'
+
+# 增量处理清单：按阶段记录已处理的输入文件（路径、大小、修改时间、内容哈希）及其产出的分块文件。
+# 阶段的聚合状态（去重过滤器、事务、计数器等）以 pickle 形式保存在 STATE_DIR 下。
+# 已记录的输入内容变化或被删除时，没有聚合状态的阶段删除其旧产出后重新处理，有聚合状态的阶段拒绝增量运行。
+# 阶段全量重跑时先删除上次记录的产出，并重置以这些产出为输入的下游阶段。
+# 内容哈希按 (路径, 大小, 修改时间) 缓存：一次运行中同一文件最多读一遍，签名未变时沿用任一阶段已记录的哈希。
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def atomic_save(path, writer):
+    # writer(f) 写入临时文件，完成后再替换目标文件
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        writer(f)
+    os.replace(tmp_path, path)
+
+def atomic_write(path, data):
+    atomic_save(path, lambda f: f.write(data))
+
+class Manifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.stages = {}
+        self.digests = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.stages = json.load(f).get('stages', {})
+
+    def stage(self, name):
+        return self.stages.setdefault(name, {'files': {}, 'next_index': 0})
+
+    def has_files(self, name):
+        return bool(self.stage(name)['files'])
+
+    def remember(self, path, entry):
+        self.digests[(path, entry['size'], entry['mtime_ns'])] = entry['sha256']
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        signature = (path, st.st_size, st.st_mtime_ns)
+        if signature not in self.digests:
+            for stage in self.stages.values():
+                entry = stage['files'].get(path)
+                if entry is not None:
+                    self.remember(path, entry)
+            if signature not in self.digests:
+                self.digests[signature] = file_digest(path)
+        return self.digests[signature]
+
+    def reset(self, name, output_dir=None):
+        # 全量重跑：删除上次记录的产出，再重置读取这些产出的下游阶段；已知的哈希留作本次记录时复用
+        output_dir = output_dir or self.stage(name).get('output_dir')
+        for path, entry in self.stage(name)['files'].items():
+            self.remember(path, entry)
+        self.stage(name)['output_dir'] = output_dir
+        for path in list(self.stage(name)['files']):
+            self.discard(name, path)
+        self.stages[name] = {'files': {}, 'next_index': 0, 'output_dir': output_dir}
+        if output_dir is None:
+            return
+        prefix = os.path.join(os.path.abspath(output_dir), '')
+        for other in list(self.stages):
+            if other != name and any(path.startswith(prefix) for path in self.stages[other]['files']):
+                print(f"阶段 {name} 的产出已重置，下游阶段 {other} 的清单与产出一并重置")
+                self.reset(other)
+
+    def status(self, name, path):
+        # 'new'：未记录；'processed'：已处理且内容未变；'changed'：已记录但内容变化
+        entry = self.stage(name)['files'].get(os.path.abspath(path))
+        if entry is None:
+            return 'new'
+        st = os.stat(path)
+        if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return 'processed'
+        # 大小或修改时间变了再比对内容哈希，内容未变只更新签名
+        if entry['sha256'] == self.digest(path):
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            return 'processed'
+        return 'changed'
+
+    def is_processed(self, name, path):
+        return self.status(name, path) == 'processed'
+
+    def new_files(self, name, paths):
+        return [path for path in paths if not self.is_processed(name, path)]
+
+    def stale_files(self, name, paths):
+        # 已记录、但内容变化或已不在 paths 中的输入
+        current = {os.path.abspath(path) for path in paths}
+        changed = [os.path.abspath(path) for path in paths if self.status(name, path) == 'changed']
+        return changed + [path for path in self.stage(name)['files'] if path not in current]
+
+    def discard(self, name, path):
+        # 删除该输入已记录的产出并移除记录，返回删除的文件。
+        # 产出文件可由多个输入共用（例如分区布局下跨分块攒成的文件），共用者的记录一并移除，之后需重新处理
+        stage = self.stage(name)
+        entry = stage['files'].pop(os.path.abspath(path), None)
+        removed = []
+        if entry is None:
+            return removed
+        if stage.get('output_dir'):
+            for output in entry['outputs']:
+                output_path = os.path.join(stage['output_dir'], output)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                    removed.append(output_path)
+        outputs = set(entry['outputs'])
+        for other in list(stage['files']):
+            if other in stage['files'] and outputs.intersection(stage['files'][other]['outputs']):
+                removed += self.discard(name, other)
+        return removed
+
+    def record(self, name, path, outputs, output_dir=None):
+        st = os.stat(path)
+        if output_dir is not None:
+            self.stage(name)['output_dir'] = output_dir
+        self.stage(name)['files'][os.path.abspath(path)] = {
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha256': self.digest(path),
+            'outputs': list(outputs)
+        }
+
+    def next_index(self, name):
+        return self.stage(name)['next_index']
+
+    def set_next_index(self, name, index):
+        self.stage(name)['next_index'] = index
+
+    def save(self):
+        atomic_write(self.path, json.dumps({'stages': self.stages}, ensure_ascii=False, indent=2).encode('utf-8'))
+
+def state_path(name, state_dir=STATE_DIR):
+    return os.path.join(state_dir, f"{name}.pkl")
+
+def save_state(name, state, state_dir=STATE_DIR):
+    atomic_write(state_path(name, state_dir), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+def load_state(name, default=None, state_dir=STATE_DIR):
+    path = state_path(name, state_dir)
+    if not os.path.exists(path):
+        return default
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+from collections import defaultdict
+from contextlib import contextmanager
+
+METRICS_PATH = './outputs/metrics.jsonl'
+PROFILE_DIR = './outputs/profiles'
+# PIPELINE_PROFILE=all 或逗号分隔的阶段名（如 clean,fpgrowth）时，对应阶段用 cProfile 包裹并写出 .prof 文件
+PROFILE_ENV = 'PIPELINE_PROFILE'
+RUN_ID = os.environ.setdefault('PIPELINE_RUN_ID', f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}")
+
+_profiling = False
+_profile_seq = 0
+
+# 每个阶段/数据块结束时向 METRICS_PATH 追加一行 JSON：
+#   run_id, script, stage, pid, wall_s, cpu_s, children_cpu_s, peak_rss_bytes, 以及调用方填入的
+#   rows_in / rows_out / bytes_read / bytes_written、分项耗时 timings 和其他字段（如 chunk、file）。
+# peak_rss_bytes 为进程（含已结束的子进程）到目前为止的峰值常驻内存。
+
+def peak_rss_bytes():
+    # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+def cpu_times():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+def profiling_enabled(name):
+    selected = os.environ.get(PROFILE_ENV, '')
+    names = {s.strip() for s in selected.split(',') if s.strip()}
+    return 'all' in names or name in names or name.split('.')[0] in names
+
+def write_record(record, path=METRICS_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+class Stage:
+    def __init__(self, name, path=METRICS_PATH, **fields):
+        self.name = name
+        self.path = path
+        self.fields = fields
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(float)
+        self.profiler = None
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] += int(value)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def timed(self, iterable, name):
+        # 对生成器逐项计时（例如 Parquet 读取 + 解码），耗时计入 timings[name]
+        iterator = iter(iterable)
+        while True:
+            with self.time(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def __enter__(self):
+        global _profiling
+        # 同一时刻只能有一个 cProfile 在运行，嵌套阶段由外层的 profile 覆盖
+        if not _profiling and profiling_enabled(self.name):
+            _profiling = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start_wall = time.perf_counter()
+        self.start_cpu, self.start_children_cpu = cpu_times()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _profiling, _profile_seq
+        wall = time.perf_counter() - self.start_wall
+        cpu, children_cpu = cpu_times()
+        record = {
+            'run_id': RUN_ID,
+            'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None,
+            'pid': os.getpid(),
+            'stage': self.name,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu - self.start_cpu, 6),
+            'children_cpu_s': round(children_cpu - self.start_children_cpu, 6),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'status': 'ok' if exc_type is None else f"error: {exc_type.__name__}"
+        }
+        record.update(self.counters)
+        if self.timings:
+            record['timings'] = {k: round(v, 6) for k, v in self.timings.items()}
+        record.update(self.fields)
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiling = False
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            _profile_seq += 1
+            profile_path = os.path.join(PROFILE_DIR, f"{RUN_ID}_{self.name}_{os.getpid()}_{_profile_seq}.prof")
+            self.profiler.dump_stats(profile_path)
+            record['profile'] = profile_path
+        write_record(record, self.path)
+        return False
+
+def stage(name, **fields):
+    return Stage(name, **fields)
+
+def load_metrics(path=METRICS_PATH, run_id=None):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if run_id is None or record.get('run_id') == run_id:
+                    records.append(record)
+    return records
@@ -0,0 +1,82 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import parquet as pq
+
+DEFAULT_CODEC = 'zstd'
+DEFAULT_LEVEL = 3
+ROW_GROUP_SIZE = 1_000_000
+# 字典编码的自动判定：字典/类别列总是编码；字符串与布尔列在不同值个数不超过行数的该比例时编码
+DICTIONARY_MAX_RATIO = 0.1
+CODECS = ['zstd', 'lz4', 'snappy', 'gzip', 'brotli', 'none']
+
+# 所有阶段共用的 parquet 输出：可配置压缩算法与级别、逐列字典编码、行组大小，以及写出前按列排序。
+# 按 (user_id, purchase_date) 等列排序后，每个行组的 min/max 统计范围更窄，按这些列过滤读取时可跳过整个行组。
+
+def dictionary_columns(table, max_ratio=DICTIONARY_MAX_RATIO):
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_dictionary(column.type):
+            columns.append(name)
+        elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type) or pa.types.is_boolean(column.type):
+            if len(column) and pc.count_distinct(column).as_py() <= max_ratio * len(column):
+                columns.append(name)
+    return columns
+
+class ParquetOutput:
+    def __init__(self, codec=DEFAULT_CODEC, level=DEFAULT_LEVEL, dictionary='auto',
+                 row_group_size=ROW_GROUP_SIZE, sort_by=None):
+        if codec not in CODECS:
+            raise ValueError(f"未知的压缩算法: {codec}（可选 {', '.join(CODECS)}）")
+        self.codec = codec
+        # 只有 zstd / gzip / brotli 支持压缩级别
+        self.level = level if codec in ('zstd', 'gzip', 'brotli') else None
+        self.dictionary = dictionary
+        self.row_group_size = row_group_size
+        self.sort_by = list(sort_by or [])
+
+    def use_dictionary(self, table):
+        if self.dictionary == 'auto':
+            return dictionary_columns(table)
+        if self.dictionary in ('all', True):
+            return True
+        if self.dictionary in ('none', False, None):
+            return False
+        return [col for col in self.dictionary if col in table.column_names]
+
+    def prepare(self, data):
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data)
+        sort_keys = [(col, 'ascending') for col in self.sort_by if col in table.column_names]
+        if sort_keys:
+            table = table.sort_by(sort_keys)
+        return table
+
+    def write(self, data, path):
+        # 接受 DataFrame 或 Arrow Table，返回写出的字节数
+        table = self.prepare(data)
+        pq.write_table(table, path, compression=self.codec, compression_level=self.level,
+                       use_dictionary=self.use_dictionary(table), row_group_size=self.row_group_size)
+        return os.path.getsize(path)
+
+    def dataset_options(self, table):
+        # 供 pyarrow.dataset.write_dataset 使用的同一组写出配置
+        return ds.ParquetFileFormat().make_write_options(compression=self.codec, compression_level=self.level,
+                                                         use_dictionary=self.use_dictionary(table))
+
+    def describe(self):
+        level = f"-{self.level}" if self.level is not None else ''
+        sort = f", sort_by={','.join(self.sort_by)}" if self.sort_by else ''
+        return f"{self.codec}{level}, dictionary={self.dictionary}, row_group_size={self.row_group_size}{sort}"
+
+def add_writer_arguments(parser, sort_by=None):
+    parser.add_argument('--codec', choices=CODECS, default=DEFAULT_CODEC, help='parquet 压缩算法')
+    parser.add_argument('--codec-level', type=int, default=DEFAULT_LEVEL, help='压缩级别（zstd/gzip/brotli）')
+    parser.add_argument('--dictionary', default='auto', help="字典编码：auto / all / none / 逗号分隔的列名")
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE)
+    parser.add_argument('--sort-by', nargs='*', default=sort_by, help='写出前按这些列排序')
+    return parser
+
+def writer_from_args(args):
+    dictionary = args.dictionary if args.dictionary in ('auto', 'all', 'none') else args.dictionary.split(',')
+    return ParquetOutput(args.codec, args.codec_level, dictionary, args.row_group_size, args.sort_by)
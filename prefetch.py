@@ -0,0 +1,196 @@
+import re
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH_DEPTH = 2
+PREFETCH_MEMORY = '1G'
+SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+SAMPLE_ROWS = 1000
+
+# 有界预取：后台线程提前读取、解码后面的批次，主线程同时处理当前批次；写出同样交给一个后台线程。
+# pyarrow 的读取、解压和 parquet 编码都会释放 GIL，因此 I/O 与 pandas 计算可以重叠。
+# 队列同时受深度（批次数）和内存预算（排队批次的字节数）限制；队列为空时总允许放入一个批次，单个超大批次不会卡死。
+# 统计（写入所在阶段的 timings）：
+#   <name>.stall —— 主线程等待的时间：读取时说明解码跟不上计算，可加大深度；写出时说明写出队列已满
+#   <name>.backpressure —— 后台读取线程因队列已满而等待的时间，说明计算是瓶颈，加大深度没有意义
+#   <name>.busy —— 后台线程实际读取/写出所用的时间
+# 以及 <name>_peak_bytes / <name>_peak_depth —— 队列的峰值占用。depth=0 时不启用后台线程，按原样顺序执行。
+
+def parse_size(text):
+    if isinstance(text, (int, float)):
+        return int(text)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)(?:I?B)?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无法解析的大小: {text}（例如 512M、8G）")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+settings = {'depth': PREFETCH_DEPTH, 'max_bytes': parse_size(PREFETCH_MEMORY)}
+
+def item_bytes(item):
+    # Arrow 表/批次与 numpy 数组直接取 nbytes；DataFrame 的字符串列按前 SAMPLE_ROWS 行的实际大小估算
+    if isinstance(item, (tuple, list)):
+        return sum(item_bytes(part) for part in item)
+    if hasattr(item, 'memory_usage') and hasattr(item, 'head'):
+        if len(item) <= SAMPLE_ROWS:
+            return int(item.memory_usage(index=False, deep=True).sum())
+        return int(item.head(SAMPLE_ROWS).memory_usage(index=False, deep=True).sum() * len(item) / SAMPLE_ROWS)
+    nbytes = getattr(item, 'nbytes', 0)
+    return int(nbytes) if isinstance(nbytes, (int, float)) else 0
+
+def report(metrics, name, stall, busy, backpressure, peak_bytes, peak_depth):
+    if metrics is None:
+        return
+    metrics.timings[f"{name}.stall"] += stall
+    metrics.timings[f"{name}.busy"] += busy
+    if backpressure is not None:
+        metrics.timings[f"{name}.backpressure"] += backpressure
+    metrics.set(**{f"{name}_peak_bytes": max(peak_bytes, metrics.fields.get(f"{name}_peak_bytes", 0)),
+                   f"{name}_peak_depth": max(peak_depth, metrics.fields.get(f"{name}_peak_depth", 0))})
+
+class Prefetcher:
+    def __init__(self, iterable, name='prefetch', metrics=None, depth=None, max_bytes=None):
+        self.iterable = iterable
+        self.name = name
+        self.metrics = metrics
+        self.depth = settings['depth'] if depth is None else depth
+        self.max_bytes = settings['max_bytes'] if max_bytes is None else max_bytes
+        self.items = deque()
+        self.queued_bytes = 0
+        self.done = self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+        self.stall = self.busy = self.backpressure = 0.0
+        self.peak_bytes = self.peak_depth = 0
+
+    def full(self, size):
+        return self.items and (len(self.items) >= self.depth or self.queued_bytes + size > self.max_bytes)
+
+    def produce(self):
+        iterator = iter(self.iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.busy += time.perf_counter() - start
+                size = item_bytes(item)
+                with self.cond:
+                    start = time.perf_counter()
+                    while not self.closed and self.full(size):
+                        self.cond.wait()
+                    self.backpressure += time.perf_counter() - start
+                    if self.closed:
+                        break
+                    self.items.append((item, size))
+                    self.queued_bytes += size
+                    self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+                    self.peak_depth = max(self.peak_depth, len(self.items))
+                    self.cond.notify_all()
+                del item
+        except BaseException as exc:
+            self.error = exc
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def __iter__(self):
+        if self.depth <= 0:
+            yield from self.iterable
+            return
+        thread = threading.Thread(target=self.produce, name=f"prefetch-{self.name}", daemon=True)
+        thread.start()
+        try:
+            while True:
+                with self.cond:
+                    start = time.perf_counter()
+                    while not self.items and not self.done:
+                        self.cond.wait()
+                    self.stall += time.perf_counter() - start
+                    if not self.items:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    item, size = self.items.popleft()
+                    self.queued_bytes -= size
+                    self.cond.notify_all()
+                yield item
+                del item
+        finally:
+            # 提前退出（break / 异常）时通知后台线程停止，并等它结束当前批次
+            with self.cond:
+                self.closed = True
+                self.items.clear()
+                self.cond.notify_all()
+            thread.join()
+            report(self.metrics, self.name, self.stall, self.busy, self.backpressure, self.peak_bytes, self.peak_depth)
+
+def prefetch(iterable, name='prefetch', metrics=None, depth=None, max_bytes=None):
+    return iter(Prefetcher(iterable, name, metrics, depth, max_bytes))
+
+class AsyncWriter:
+    # 单个后台线程按提交顺序执行写出任务（返回写出的字节数）；写出异常在下一次 submit 或 close 时抛出
+    def __init__(self, name='write', depth=None, max_bytes=None):
+        self.name = name
+        self.depth = settings['depth'] if depth is None else depth
+        self.max_bytes = settings['max_bytes'] if max_bytes is None else max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name) if self.depth > 0 else None
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.results = []
+        self.stall = self.busy = 0.0
+        self.peak_bytes = self.peak_depth = 0
+
+    def run(self, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.busy += time.perf_counter() - start
+
+    def retire(self):
+        future, size = self.pending.popleft()
+        self.pending_bytes -= size
+        self.results.append(future.result())
+
+    def submit(self, fn, *args, size=None, **kwargs):
+        if self.executor is None:
+            self.results.append(self.run(fn, args, kwargs))
+            return
+        size = item_bytes(args) if size is None else size
+        start = time.perf_counter()
+        while self.pending and (len(self.pending) >= self.depth or self.pending_bytes + size > self.max_bytes):
+            self.retire()
+        self.stall += time.perf_counter() - start
+        self.pending.append((self.executor.submit(self.run, fn, args, kwargs), size))
+        self.pending_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.pending_bytes)
+        self.peak_depth = max(self.peak_depth, len(self.pending))
+
+    def close(self, metrics=None):
+        # 等待全部写出完成，返回各任务的结果（按提交顺序）
+        start = time.perf_counter()
+        try:
+            while self.pending:
+                self.retire()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.stall += time.perf_counter() - start
+            report(metrics, self.name, self.stall, self.busy, None, self.peak_bytes, self.peak_depth)
+        return self.results
+
+def add_prefetch_arguments(parser):
+    parser.add_argument('--prefetch-depth', type=int, default=PREFETCH_DEPTH, help='预取/写出队列的最大批次数，0 表示不使用后台线程')
+    parser.add_argument('--prefetch-memory', default=PREFETCH_MEMORY, help='预取/写出队列的内存预算，例如 512M、2G')
+    return parser
+
+def configure(args):
+    settings['depth'] = args.prefetch_depth
+    settings['max_bytes'] = parse_size(args.prefetch_memory)
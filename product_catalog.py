@@ -0,0 +1,98 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from manifest import file_digest, atomic_save
+
+PRODUCT_CATALOG_PATH = './product_catalog.json'
+CATALOG_CACHE_DIR = './outputs/catalog_cache'
+UNKNOWN_CATEGORY = '未知'
+UNKNOWN_PRICE = -1
+ARRAY_FILES = ['ids', 'category_codes', 'prices']
+
+_catalogs = {}
+
+def source_signature(path):
+    st = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def compile_catalog(json_path=PRODUCT_CATALOG_PATH, cache_dir=CATALOG_CACHE_DIR):
+    # 把 JSON 目录编译为按 id 排序的 ids / category_codes / prices 三个 .npy 数组和一个类别表
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        raw_catalog = json.load(f)
+    df = pd.DataFrame(raw_catalog['products'], columns=['id', 'category', 'price'])
+    try:
+        df['id'] = df['id'].astype(np.int64)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"商品目录中的 id 必须为整数: {e}")
+    df = df.drop_duplicates(subset='id', keep='last').sort_values('id')
+    codes, uniques = pd.factorize(df['category'])
+    categories = [str(c) for c in uniques]
+    arrays = {
+        'ids': df['id'].to_numpy(dtype=np.int64),
+        'category_codes': codes.astype(np.int32),
+        'prices': df['price'].to_numpy(dtype=np.float64)
+    }
+    for name, values in arrays.items():
+        atomic_save(os.path.join(cache_dir, f"{name}.npy"), lambda f, v=values: np.save(f, v))
+    meta = dict(source_signature(json_path), sha256=file_digest(json_path), categories=categories)
+    atomic_save(os.path.join(cache_dir, 'meta.json'),
+                lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+    print(f"商品目录已编译: {len(df)} 个商品, {len(categories)} 个类别 → {cache_dir}")
+    return meta
+
+def ensure_compiled(json_path=PRODUCT_CATALOG_PATH, cache_dir=CATALOG_CACHE_DIR):
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path) or not all(os.path.exists(os.path.join(cache_dir, f"{n}.npy")) for n in ARRAY_FILES):
+        return compile_catalog(json_path, cache_dir)
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    signature = source_signature(json_path)
+    if all(meta.get(k) == v for k, v in signature.items()):
+        return meta
+    # 大小或修改时间变化时再比较内容哈希，内容未变只刷新签名
+    if meta.get('sha256') != file_digest(json_path):
+        return compile_catalog(json_path, cache_dir)
+    meta.update(signature)
+    atomic_save(meta_path, lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+    return meta
+
+class ProductCatalog:
+    def __init__(self, json_path=PRODUCT_CATALOG_PATH, cache_dir=CATALOG_CACHE_DIR):
+        meta = ensure_compiled(json_path, cache_dir)
+        self.ids = np.load(os.path.join(cache_dir, 'ids.npy'), mmap_mode='r')
+        self.category_codes = np.load(os.path.join(cache_dir, 'category_codes.npy'), mmap_mode='r')
+        self.prices = np.load(os.path.join(cache_dir, 'prices.npy'), mmap_mode='r')
+        categories = list(meta['categories'])
+        if UNKNOWN_CATEGORY not in categories:
+            categories.append(UNKNOWN_CATEGORY)
+        self.unknown_code = categories.index(UNKNOWN_CATEGORY)
+        self.categories = pa.array(categories, type=pa.string())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, ids):
+        # 向量化查询：返回 (类别字典数组, 价格数组)，未命中的 id 取 '未知' / -1
+        ids = pa.array(ids) if not isinstance(ids, (pa.Array, pa.ChunkedArray)) else ids
+        valid = pc.is_valid(ids).to_numpy(zero_copy_only=False)
+        keys = pc.fill_null(pc.cast(ids, pa.int64()), 0).to_numpy(zero_copy_only=False)
+        if len(self.ids) == 0:
+            codes = np.full(len(keys), self.unknown_code, dtype=np.int32)
+            prices = np.full(len(keys), UNKNOWN_PRICE, dtype=np.float64)
+        else:
+            pos = np.minimum(np.searchsorted(self.ids, keys), len(self.ids) - 1)
+            found = (self.ids[pos] == keys) & valid
+            codes = np.where(found, self.category_codes[pos], self.unknown_code).astype(np.int32)
+            prices = np.where(found, self.prices[pos], UNKNOWN_PRICE).astype(np.float64)
+        return pa.DictionaryArray.from_arrays(pa.array(codes), self.categories), prices
+
+def get_catalog(json_path=PRODUCT_CATALOG_PATH, cache_dir=CATALOG_CACHE_DIR):
+    # 首次使用时才加载；同一进程内复用已映射的数组
+    key = (os.path.abspath(json_path), os.path.abspath(cache_dir))
+    if key not in _catalogs:
+        _catalogs[key] = ProductCatalog(json_path, cache_dir)
+    return _catalogs[key]
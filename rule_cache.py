@@ -0,0 +1,242 @@
+import os
+import json
+import math
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from mlxtend.frequent_patterns import association_rules
+from manifest import atomic_save, atomic_write
+from mining import mine_frequent_itemsets
+from metrics import stage
+
+RULE_CACHE_DIR = './outputs/rule_cache'
+INDEX_FILE = 'index.json'
+RULE_COLUMNS = ['antecedents', 'consequents', 'antecedent support', 'consequent support', 'support', 'confidence',
+                'lift', 'representativity', 'leverage', 'conviction', 'zhangs_metric', 'jaccard', 'certainty', 'kulczynski']
+
+# 频繁项集缓存：以事务内容的哈希为键，保存在某个（较低的）最小支持度下挖出的全部频繁项集及其计数。
+# 更高的支持度、不同的置信度/提升度阈值、按前件/后件/涉及的项筛选规则，都直接在缓存上完成，不再重建事务或重跑 fpgrowth。
+# 存储为一个 .npz：
+#   itemset_offsets / itemset_items —— CSR 形式的项集（项编码升序），counts —— 各项集出现的事务数；
+#   item_offsets / item_itemsets —— 倒排索引，第 i 个项出现在哪些项集中；vocab —— 项编码到项名。
+# 项集按 (长度, 计数降序, 项名) 排列，取子集时顺序与挖掘时的支持度下限无关。
+# index.json 记录每个任务名最近一次使用的缓存，供命令行按任务名重新查询；不再被任何任务引用的 .npz 随即删除。
+
+def transactions_digest(transactions, block=1 << 22):
+    # 分块计算，事务为内存映射时不必整体载入；结果与一次性计算相同
+    digest = hashlib.sha256()
+    for array, dtype in ((transactions.offsets, np.int64), (transactions.items, np.int32)):
+        for start in range(0, len(array), block):
+            digest.update(np.ascontiguousarray(array[start:start + block], dtype=dtype).tobytes())
+    digest.update('\x00'.join(str(v) for v in transactions.vocab).encode('utf-8'))
+    return digest.hexdigest()
+
+def min_count(min_support, n_transactions):
+    # 与 fpgrowth / SON 的判定一致：计数不少于 ceil(min_support × 事务数)
+    return max(math.ceil(min_support * n_transactions), 0)
+
+class ItemsetLattice:
+    def __init__(self, vocab, n_transactions, min_support, itemset_offsets, itemset_items, counts,
+                 item_offsets=None, item_itemsets=None):
+        self.vocab = np.asarray(vocab, dtype=object)
+        self.n_transactions = int(n_transactions)
+        self.min_support = float(min_support)
+        self.itemset_offsets = np.asarray(itemset_offsets, dtype=np.int64)
+        self.itemset_items = np.asarray(itemset_items, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.position = None
+        if item_offsets is None:
+            self.build_index()
+        else:
+            self.item_offsets = np.asarray(item_offsets, dtype=np.int64)
+            self.item_itemsets = np.asarray(item_itemsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_frame(cls, itemsets, vocab, n_transactions, min_support):
+        code_of_name = {name: code for code, name in enumerate(vocab)}
+        codes = [sorted(code_of_name[name] for name in itemset) for itemset in itemsets['itemsets']]
+        counts = np.rint(itemsets['support'].to_numpy(dtype=np.float64) * n_transactions).astype(np.int64)
+        names = np.asarray(vocab, dtype=object)
+        order = sorted(range(len(codes)), key=lambda i: (len(codes[i]), -counts[i], [str(names[c]) for c in codes[i]]))
+        codes = [codes[i] for i in order]
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(c) for c in codes], dtype=np.int64), out=offsets[1:])
+        items = np.array([c for itemset in codes for c in itemset], dtype=np.int32)
+        return cls(vocab, n_transactions, min_support, offsets, items, counts[order])
+
+    def build_index(self):
+        lengths = np.diff(self.itemset_offsets)
+        owner = np.repeat(np.arange(len(self.counts), dtype=np.int64), lengths)
+        order = np.argsort(self.itemset_items, kind='stable')
+        self.item_itemsets = owner[order]
+        self.item_offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.itemset_items, minlength=len(self.vocab)), out=self.item_offsets[1:])
+
+    def itemset(self, i):
+        return self.itemset_items[self.itemset_offsets[i]:self.itemset_offsets[i + 1]]
+
+    def lookup(self, codes):
+        # 项编码元组 -> 项集编号，第一次按项筛选时才建立
+        if self.position is None:
+            items = self.itemset_items.tolist()
+            offsets = self.itemset_offsets.tolist()
+            self.position = {tuple(items[offsets[i]:offsets[i + 1]]): i for i in range(len(self.counts))}
+        return self.position[codes]
+
+    def codes(self, names):
+        code_of_name = {name: code for code, name in enumerate(self.vocab)}
+        return [code_of_name[name] for name in names if name in code_of_name]
+
+    def containing(self, names):
+        # 倒排索引：包含任一给定项的项集编号
+        ids = [self.item_itemsets[self.item_offsets[c]:self.item_offsets[c + 1]] for c in self.codes(names)]
+        return np.unique(np.concatenate(ids)) if ids else np.zeros(0, dtype=np.int64)
+
+    def select(self, min_support, involving=None):
+        if min_support < self.min_support:
+            raise ValueError(f"缓存只包含支持度不低于 {self.min_support} 的项集，无法查询 {min_support}")
+        threshold = min_count(min_support, self.n_transactions)
+        keep = (self.counts >= threshold) & (self.counts / float(self.n_transactions) >= min_support)
+        if involving is None:
+            return np.flatnonzero(keep)
+        # 生成规则时需要含这些项的项集 S 及其全部子集的支持度。S 的子集若含这些项中的某个 x，本身也在含这些项的项集中；
+        # 否则它是 S 去掉这些项后的某个子集 T，而 T ∪ {x} ⊆ S 同样是含这些项的频繁项集，
+        # 所以只需再补上每个 S 去掉这些项后的剩余部分，不必枚举子集
+        wanted = set(self.codes(involving))
+        ids = [i for i in self.containing(involving) if keep[i]]
+        rest = {tuple(c for c in self.itemset(i).tolist() if c not in wanted) for i in ids}
+        ids += [self.lookup(codes) for codes in rest if codes]
+        return np.unique(np.array(ids, dtype=np.int64))
+
+    def frequent_itemsets(self, min_support, involving=None):
+        ids = self.select(min_support, involving)
+        return pd.DataFrame({
+            'support': self.counts[ids] / float(self.n_transactions),
+            'itemsets': [frozenset(sorted(self.vocab[self.itemset(i)])) for i in ids]
+        }, columns=['support', 'itemsets'])
+
+    def rules(self, min_support, metric='confidence', min_threshold=0.8, min_lift=None,
+              involving=None, antecedents=None, consequents=None):
+        itemsets = self.frequent_itemsets(min_support, involving)
+        if itemsets.empty:
+            return pd.DataFrame(columns=RULE_COLUMNS)
+        rules = association_rules(itemsets, metric=metric, min_threshold=min_threshold)
+        keep = np.ones(len(rules), dtype=bool)
+        if involving is not None:
+            wanted = set(involving)
+            keep &= ~(rules['antecedents'].apply(wanted.isdisjoint) &
+                      rules['consequents'].apply(wanted.isdisjoint)).to_numpy(dtype=bool)
+        if antecedents is not None:
+            keep &= rules['antecedents'].apply(frozenset(antecedents).issubset).to_numpy(dtype=bool)
+        if consequents is not None:
+            keep &= rules['consequents'].apply(frozenset(consequents).issubset).to_numpy(dtype=bool)
+        if min_lift is not None:
+            keep &= (rules['lift'] >= min_lift).to_numpy(dtype=bool)
+        return rules[keep].reset_index(drop=True)
+
+    def save(self, path):
+        atomic_save(path, lambda f: np.savez(f, vocab=self.vocab.astype(str), n_transactions=self.n_transactions, min_support=self.min_support,
+                 itemset_offsets=self.itemset_offsets, itemset_items=self.itemset_items, counts=self.counts,
+                 item_offsets=self.item_offsets, item_itemsets=self.item_itemsets))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['vocab'].astype(object), data['n_transactions'], data['min_support'],
+                       data['itemset_offsets'], data['itemset_items'], data['counts'],
+                       data['item_offsets'], data['item_itemsets'])
+
+def cache_path(digest, cache_dir=RULE_CACHE_DIR):
+    return os.path.join(cache_dir, f"{digest}.npz")
+
+def read_index(cache_dir=RULE_CACHE_DIR):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def register(name, digest, cache_dir=RULE_CACHE_DIR):
+    index = read_index(cache_dir)
+    index[name] = digest
+    atomic_write(os.path.join(cache_dir, INDEX_FILE), json.dumps(index, ensure_ascii=False, indent=2).encode('utf-8'))
+    prune(index, cache_dir)
+
+def prune(index, cache_dir=RULE_CACHE_DIR):
+    # 事务变化后旧缓存不会再命中，只保留 index.json 仍引用的缓存
+    referenced = {f"{digest}.npz" for digest in index.values()}
+    for filename in os.listdir(cache_dir):
+        if filename.endswith('.npz') and filename not in referenced:
+            os.remove(os.path.join(cache_dir, filename))
+
+def load_or_mine(transactions, min_support, cache_support=None, partitions=None, workers=None, name=None,
+                 cache_dir=RULE_CACHE_DIR):
+    # 命中缓存且缓存的支持度下限不高于 min_support 时直接返回；否则在 min(cache_support, min_support) 下挖掘并写入缓存
+    floor = min_support if cache_support is None else min(cache_support, min_support)
+    digest = transactions_digest(transactions)
+    path = cache_path(digest, cache_dir)
+    with stage('mining.cache', task=name, digest=digest[:12]) as m:
+        lattice = ItemsetLattice.load(path) if os.path.exists(path) else None
+        if lattice is not None and lattice.min_support <= min_support:
+            print(f"命中频繁项集缓存 {digest[:12]}（支持度下限 {lattice.min_support}）")
+            m.set(hit=True)
+        else:
+            m.set(hit=False)
+            itemsets = mine_frequent_itemsets(transactions, floor, partitions, workers)
+            with m.time('index'):
+                lattice = ItemsetLattice.from_frame(itemsets, transactions.vocab, len(transactions), floor)
+                lattice.save(path)
+            print(f"频繁项集已缓存: {path}（支持度下限 {floor}，{len(lattice)} 个项集）")
+        m.add(rows_out=len(lattice))
+    if name is not None:
+        register(name, digest, cache_dir)
+    return lattice
+
+def load_named(name, cache_dir=RULE_CACHE_DIR):
+    digest = read_index(cache_dir).get(name)
+    if digest is None or not os.path.exists(cache_path(digest, cache_dir)):
+        raise FileNotFoundError(f"没有任务 {name} 的频繁项集缓存，请先运行该任务")
+    return ItemsetLattice.load(cache_path(digest, cache_dir))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在已缓存的频繁项集上重新查询关联规则（不重建事务、不重跑 fpgrowth）')
+    parser.add_argument('task', help='任务名，例如 task1 / task2 / task4')
+    parser.add_argument('--min-support', type=float, help='默认取缓存的支持度下限')
+    parser.add_argument('--metric', default='confidence')
+    parser.add_argument('--min-threshold', type=float, default=0.5)
+    parser.add_argument('--min-lift', type=float)
+    parser.add_argument('--involving', nargs='+', help='只看前件或后件包含任一这些项的规则')
+    parser.add_argument('--antecedents', nargs='+', help='前件必须包含这些项')
+    parser.add_argument('--consequents', nargs='+', help='后件必须包含这些项')
+    parser.add_argument('--sort-by', default='lift')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help='把查询结果保存为 CSV')
+    args = parser.parse_args()
+
+    try:
+        with stage('rule_cache.query', task=args.task) as m:
+            start = time.perf_counter()
+            with m.time('load'):
+                lattice = load_named(args.task)
+            min_support = lattice.min_support if args.min_support is None else args.min_support
+            with m.time('rules'):
+                rules = lattice.rules(min_support, args.metric, args.min_threshold, args.min_lift,
+                                      args.involving, args.antecedents, args.consequents)
+            elapsed = time.perf_counter() - start
+            m.add(rows_in=len(lattice), rows_out=len(rules))
+    except (FileNotFoundError, ValueError) as e:
+        # 缓存不存在或查询的支持度低于缓存下限：提示后退出，不打印堆栈
+        parser.exit(1, f"查询失败: {e}\n")
+    rules = rules.sort_values(by=args.sort_by, ascending=False)
+    print(f"{len(lattice)} 个缓存项集（支持度下限 {lattice.min_support}），支持度 ≥ {min_support} 下共 {len(rules)} 条规则，"
+          f"查询耗时 {elapsed * 1000:.1f} 毫秒")
+    with pd.option_context('display.max_colwidth', 60, 'display.width', 200):
+        print(rules.head(args.top)[['antecedents', 'consequents', 'support', 'confidence', 'lift']])
+    if args.output:
+        rules.to_csv(args.output, index=False)
+        print(f"查询结果已保存至: {args.output}")
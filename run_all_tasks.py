@@ -0,0 +1,16 @@
+from scan_driver import run_scan, parse_scan_args, EXPANDED_DIR, CHUNKSIZE
+from task1_association_rules import CategoryTransactionTask
+from task2_payment_analysis import PaymentAnalysisTask
+from task3_time_series_analysis import TimeSeriesTask
+from task4_refund_pattern_analysis import RefundPatternTask
+
+# 一次扫描 expanded_items，同时完成任务 1–4；各任务脚本仍可单独运行
+if __name__ == '__main__':
+    args = parse_scan_args('单次扫描完成任务 1–4')
+    print("单次扫描 expanded_items，同时构建任务 1–4 的中间结果……")
+    run_scan([
+        CategoryTransactionTask(),
+        PaymentAnalysisTask(),
+        TimeSeriesTask(),
+        RefundPatternTask()
+    ], EXPANDED_DIR, batch_size=CHUNKSIZE, incremental=args.incremental)
@@ -0,0 +1,183 @@
+import os
+import argparse
+from tqdm import tqdm
+from manifest import Manifest, save_state, load_state
+from metrics import stage
+from dataset_layout import open_dataset, partition_names
+from prefetch import prefetch, item_bytes, add_prefetch_arguments, configure as configure_prefetch
+from batching import rebatch, batch_sizer, UNIT_ROWS, add_memory_argument, configure as configure_batching
+from mining import add_mining_arguments, configure as configure_mining
+
+EXPANDED_DIR = './outputs/expanded_items_chunks'
+CHUNKSIZE = 500_000
+
+# 任务消费者约定：
+#   columns  —— 该任务需要读取的列（包括 filter 中用到的列）
+#   filter —— 可选的 pyarrow.dataset 过滤表达式，下推到行组统计/字典页，只有满足条件的行会被解码；
+#            分区布局下还用于跳过不满足条件的分区目录
+#   filter_for(schema) —— 可选，代替 filter，按数据集的 schema（例如是否有 year 分区列）给出过滤表达式
+#   state_name —— 增量运行时保存聚合状态与清单阶段所用的名字
+#   config —— 可选，由构造参数决定的属性名（例如 task3 的 years），不作为聚合状态恢复；
+#            增量运行时与保存状态时的取值不同则拒绝运行
+#   consume(df) —— 处理一个批次（不得原地修改 df，多个任务共享同一批次）；结果不得依赖批次边界——
+#            单独扫描与合并扫描的过滤条件不同，同一任务收到的批次切分也不同
+#   consume_table(table) —— 可选，定义后直接接收过滤、投影后的 Arrow 表，由任务自行决定何时转换为 pandas
+#   finish() —— 扫描结束后汇总并输出结果
+def required_columns(consumers):
+    columns = []
+    for consumer in consumers:
+        for col in consumer.columns:
+            if col not in columns:
+                columns.append(col)
+    return columns
+
+def consumer_filter(consumer, schema=None):
+    if hasattr(consumer, 'filter_for'):
+        return consumer.filter_for(schema)
+    return getattr(consumer, 'filter', None)
+
+def combined_filter(consumers, schema=None):
+    # 只要有一个任务需要全部行就不能在扫描时过滤；否则取各任务条件的并集
+    filters = [consumer_filter(c, schema) for c in consumers]
+    if not filters or any(f is None for f in filters):
+        return None
+    combined = filters[0]
+    for f in filters[1:]:
+        combined = combined | f
+    return combined
+
+def scan_fragment(dataset, fragment, columns, filter=None, batch_size=CHUNKSIZE, sizer=None):
+    # 按数据集的统一 schema 读取，分区列的值由目录名补齐；有内存预算时由 sizer 决定每个批次的行数
+    fragment_columns = [col for col in columns if col in dataset.schema.names]
+    if sizer is None:
+        batches = fragment.to_batches(schema=dataset.schema, columns=fragment_columns, filter=filter, batch_size=batch_size)
+        return rebatch(batches, batch_size)
+    sizer.prime(fragment.metadata, fragment_columns)
+    batches = fragment.to_batches(schema=dataset.schema, columns=fragment_columns, filter=filter, batch_size=UNIT_ROWS)
+    return sizer.split(batches)
+
+def consumer_table(consumer, table, scan_filter, schema=None):
+    own = consumer_filter(consumer, schema)
+    if own is not None and (scan_filter is None or not own.equals(scan_filter)):
+        table = table.filter(own)
+    return table.select([col for col in consumer.columns if col in table.column_names])
+
+def scan_stage(consumer):
+    return f"scan_{consumer.state_name}"
+
+def consumer_config(consumer):
+    return {name: getattr(consumer, name) for name in getattr(consumer, 'config', ())}
+
+def consumer_state(consumer):
+    # 除配置外，消费者的全部属性（事务构建器、计数器等）即为其聚合状态
+    config = consumer_config(consumer)
+    state = {k: v for k, v in consumer.__dict__.items() if k not in config}
+    state['__config__'] = config
+    return state
+
+def restore_consumer(consumer):
+    state = load_state(consumer.state_name)
+    if state is not None:
+        state = dict(state)
+        saved = state.pop('__config__', {})
+        if saved != consumer_config(consumer):
+            raise ValueError(f"{consumer.state_name}: 本次参数 {consumer_config(consumer)} 与已保存状态的参数 {saved} 不同，"
+                             f"请去掉 --incremental 全量运行")
+        consumer.__dict__.update({k: v for k, v in state.items() if k not in saved})
+    return consumer
+
+def run_scan(consumers, input_dir=EXPANDED_DIR, batch_size=CHUNKSIZE, incremental=False):
+    # 每个批次只读取、解码一次，依次交给所有已注册的任务
+    # incremental=True 时各任务从上次保存的状态继续，只读取清单中该任务尚未处理过的文件
+    # 输入可以是平铺的 .parquet 文件，也可以是 hive 分区目录；分区布局下按分区目录剪枝，
+    # 只读取满足各任务过滤条件的分区，被跳过的文件同样记入清单
+    manifest = Manifest()
+    dataset = open_dataset(input_dir)
+    schema = dataset.schema
+    partitions = partition_names(dataset)
+    fragments = sorted(dataset.get_fragments(), key=lambda f: f.path)
+    pending, selected = {}, {}
+    sizer = batch_sizer()
+    for consumer in consumers:
+        if incremental:
+            # 已扫描的文件变化或被删除（例如上游重新展开）时，聚合状态中已含有其旧数据，无法回滚
+            stale = manifest.stale_files(scan_stage(consumer), [f.path for f in fragments])
+            if stale:
+                raise ValueError(f"{consumer.state_name}: {len(stale)} 个已扫描的文件已变化或被删除，"
+                                 f"聚合状态无法回滚，请去掉 --incremental 全量运行")
+            if manifest.has_files(scan_stage(consumer)):
+                restore_consumer(consumer)
+            pending[id(consumer)] = set(manifest.new_files(scan_stage(consumer), [f.path for f in fragments]))
+            print(f"{consumer.state_name}: 增量读取 {len(pending[id(consumer)])} 个新文件")
+        else:
+            manifest.reset(scan_stage(consumer))
+            pending[id(consumer)] = {f.path for f in fragments}
+        own = consumer_filter(consumer, schema)
+        if partitions and own is not None:
+            selected[id(consumer)] = {f.path for f in dataset.get_fragments(filter=own)}
+    with stage('scan', tasks=[c.state_name for c in consumers], incremental=incremental,
+               partitioned=bool(partitions)) as scan_metrics:
+        for fragment in tqdm(fragments, desc='扫描 expanded_items'):
+            file_path = fragment.path
+            owners = [c for c in consumers if file_path in pending[id(c)]]
+            targets = [c for c in owners if file_path in selected.get(id(c), (file_path,))]
+            if not targets:
+                scan_metrics.add(files_skipped=bool(owners))
+            else:
+                scan_filter = combined_filter(targets, schema)
+                # 分区列的值在每个文件内是常量，读出来代价很小，供各任务在内存中再次过滤时使用
+                filtered = any(consumer_filter(c, schema) is not None for c in targets)
+                columns = required_columns(targets) + (partitions if filtered else [])
+                fname = os.path.relpath(file_path, input_dir)
+                with stage('scan.file', file=fname, bytes_read=os.path.getsize(file_path)) as m:
+                    # 后台线程读取、解码并拼好下一个批次，各任务同时处理当前批次
+                    batches = prefetch(scan_fragment(dataset, fragment, list(dict.fromkeys(columns)), scan_filter,
+                                                     batch_size, sizer), 'prefetch', m)
+                    for table in m.timed(batches, 'read_decode'):
+                        m.add(rows_in=table.num_rows)
+                        # 没有过滤条件的 pandas 任务共享同一次转换
+                        shared = None
+                        working_set = table.nbytes
+                        for consumer in targets:
+                            with m.time(consumer.state_name):
+                                if hasattr(consumer, 'consume_table'):
+                                    consumer.consume_table(consumer_table(consumer, table, scan_filter, schema))
+                                elif consumer_filter(consumer, schema) is None:
+                                    if shared is None:
+                                        shared = table.select([c for c in required_columns(targets) if c in table.column_names]).to_pandas()
+                                        working_set += item_bytes(shared)
+                                    consumer.consume(shared)
+                                else:
+                                    df = consumer_table(consumer, table, scan_filter, schema).to_pandas()
+                                    working_set += item_bytes(df)
+                                    consumer.consume(df)
+                                    del df
+                        if sizer is not None:
+                            sizer.observe(table.num_rows, working_set)
+                            m.set(bytes_per_row=round(sizer.bytes_per_row, 1))
+                scan_metrics.add(rows_in=m.counters['rows_in'], bytes_read=os.path.getsize(file_path))
+            for consumer in owners:
+                manifest.record(scan_stage(consumer), file_path, [])
+        with scan_metrics.time('save_state'):
+            for consumer in consumers:
+                save_state(consumer.state_name, consumer_state(consumer))
+            manifest.save()
+    results = []
+    for consumer in consumers:
+        with stage(f"{consumer.state_name}.finish"):
+            results.append(consumer.finish())
+    return results
+
+def parse_scan_args(description, add_arguments=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--incremental', action='store_true', help='只读取新增的 expanded_items 文件，并与已保存的状态合并')
+    add_prefetch_arguments(parser)
+    add_memory_argument(parser)
+    add_mining_arguments(parser)
+    if add_arguments is not None:
+        add_arguments(parser)
+    args = parser.parse_args()
+    configure_prefetch(args)
+    configure_batching(args)
+    configure_mining(args)
+    return args
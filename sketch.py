@@ -0,0 +1,62 @@
+import math
+import numpy as np
+
+SKETCH_K = 400
+SKETCH_DECAY = 2 / 3
+
+# KLL 流式分位数草图：第 h 层的每个样本代表 2^h 个原始值，层满时排序后随机取奇数位或偶数位提升到上一层。
+# 顶层容量为 k，往下每层按 2/3 递减，总内存约 3k 个样本，与数据量基本无关。
+# 单个分位数的秩误差大致与 1/k 成正比（k=200 时约 1.3%）；两个草图可直接合并，适合分块/多进程构建。
+
+class KLLSketch:
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.levels = [np.zeros(0, dtype=np.float64)]
+        self.n = 0
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * SKETCH_DECAY ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+
+    def compress(self):
+        # 自底向上压缩超出容量的层；大批量写入时会逐层连续减半，直到各层都不超容量
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0, dtype=np.float64))
+                items = np.sort(self.levels[level])
+                odd = len(items) % 2
+                self.levels[level] = items[:odd]
+                promoted = items[odd:][self.rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0, dtype=np.float64))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.compress()
+        return self
+
+    def quantiles(self, qs):
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return np.full(len(qs), np.nan)
+        weights = np.concatenate([np.full(len(items), 2 ** h, dtype=np.float64) for h, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        ranks = np.asarray(qs, dtype=np.float64) * cumulative[-1]
+        return items[np.minimum(np.searchsorted(cumulative, ranks, side='left'), len(items) - 1)]
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import numpy as np
+from manifest import STATE_DIR
+
+SPILL_ROWS = 2_000_000
+
+# 按分区落盘的列式缓冲：append 时按分区号拆分，缓冲超过 SPILL_ROWS 行就写成 .npz 段文件。
+# 对象被 pickle 时先落盘剩余缓冲，只保存段文件列表，因此可随任务状态一起持久化、在增量运行中继续追加。
+# 读取时一次只加载一个分区，内存占用约为 总行数 / 分区数。
+
+class PartitionedSpill:
+    def __init__(self, name, columns, partitions=16, spill_dir=STATE_DIR, spill_rows=SPILL_ROWS):
+        self.directory = os.path.join(spill_dir, name)
+        self.columns = list(columns)
+        self.partitions = partitions
+        self.spill_rows = spill_rows
+        self.segments = [[] for _ in range(partitions)]
+        self.buffer = [[] for _ in range(partitions)]
+        self.buffered_rows = 0
+
+    def append(self, partition_ids, **arrays):
+        order = np.argsort(partition_ids, kind='stable')
+        bounds = np.searchsorted(partition_ids[order], np.arange(self.partitions + 1))
+        for p in range(self.partitions):
+            sel = order[bounds[p]:bounds[p + 1]]
+            if len(sel):
+                self.buffer[p].append({col: arrays[col][sel] for col in self.columns})
+        self.buffered_rows += len(partition_ids)
+        if self.buffered_rows >= self.spill_rows:
+            self.flush()
+
+    def flush(self):
+        if self.buffered_rows == 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for p, parts in enumerate(self.buffer):
+            if not parts:
+                continue
+            fd, path = tempfile.mkstemp(dir=self.directory, prefix=f"p{p}_", suffix='.npz')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **{col: np.concatenate([part[col] for part in parts]) for col in self.columns})
+            self.segments[p].append(os.path.basename(path))
+        self.buffer = [[] for _ in range(self.partitions)]
+        self.buffered_rows = 0
+
+    def load_partition(self, p):
+        parts = [np.load(os.path.join(self.directory, name)) for name in self.segments[p]]
+        parts += [{col: part[col] for col in self.columns} for part in self.buffer[p]]
+        if not parts:
+            return None
+        return {col: np.concatenate([part[col] for part in parts]) for col in self.columns}
+
+    def remove_stale(self):
+        # 删除不属于当前状态的段文件（例如上一次全量运行留下的）
+        if not os.path.isdir(self.directory):
+            return
+        current = {name for names in self.segments for name in names}
+        for name in os.listdir(self.directory):
+            if name not in current:
+                os.remove(os.path.join(self.directory, name))
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__
@@ -1,9 +1,12 @@
 import os
 import pandas as pd
-from pyarrow.parquet import ParquetFile
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 from collections import defaultdict
-from mlxtend.frequent_patterns import fpgrowth, association_rules
-from sklearn.preprocessing import MultiLabelBinarizer
+from scan_driver import run_scan, parse_scan_args
+from transactions import TransactionBuilder
+from rule_cache import load_or_mine
 
 INPUT_DIR = './outputs/expanded_items_chunks'
 TASK2_OUTPUT_DIR = './outputs/task2'
@@ -13,37 +16,50 @@ RULES_OUTPUT_CSV = os.path.join(TASK2_OUTPUT_DIR, 'task2_payment_category_rules.
 HIGH_VALUE_STATS_CSV = os.path.join(TASK2_OUTPUT_DIR, 'task2_high_value_by_payment.csv')
 MIN_SUPPORT = 0.01
 MIN_CONFIDENCE = 0.6
+# 频繁项集按该支持度挖掘并缓存（见 rule_cache.py），调高阈值后重新运行或查询时不必重跑 FP-Growth
+CACHE_MIN_SUPPORT = 0.005
 CHUNKSIZE = 500_000
 
-payment_category_transactions = []
-high_value_counts = defaultdict(int)
-high_value_total = 0
-
-for fname in sorted(os.listdir(INPUT_DIR)):
-    if not fname.endswith('.parquet'):
-        continue
-    pf = ParquetFile(os.path.join(INPUT_DIR, fname))
-    for batch in pf.iter_batches(batch_size=CHUNKSIZE):
-        df = batch.to_pandas()
-        df = df.dropna(subset=['item_category', 'payment_method', 'purchase_date'])
-        grouped = df.groupby(['payment_method', 'purchase_date'])
-        for (payment, date), group in grouped:
-            cats = set(group['item_category'])
-            if cats:
-                payment_category_transactions.append([payment] + list(cats))
-        high_value = df[df['is_high_value'] == True]
-        for method, count in high_value['payment_method'].value_counts().items():
-            high_value_counts[method] += count
-            high_value_total += count
-
-pd.Series(payment_category_transactions).to_csv(CATEGORY_TRANS_CSV, index=False, header=False)
-
-mlb = MultiLabelBinarizer()
-onehot = pd.DataFrame(mlb.fit_transform(payment_category_transactions), columns=mlb.classes_)
-freq_itemsets = fpgrowth(onehot, min_support=MIN_SUPPORT, use_colnames=True)
-rules = association_rules(freq_itemsets, metric="confidence", min_threshold=MIN_CONFIDENCE)
-rules.to_csv(RULES_OUTPUT_CSV, index=False)
-
-high_value_df = pd.DataFrame(list(high_value_counts.items()), columns=['payment_method', 'count'])
-high_value_df['ratio'] = high_value_df['count'] / high_value_total
-high_value_df.to_csv(HIGH_VALUE_STATS_CSV, index=False)
\ No newline at end of file
+class PaymentAnalysisTask:
+    columns = ['item_category', 'payment_method', 'purchase_date', 'is_high_value']
+    state_name = 'task2'
+
+    def __init__(self):
+        self.builder = TransactionBuilder(['payment_method', 'purchase_date'], 'item_category',
+                                          label_column='payment_method', name=self.state_name)
+        self.high_value_counts = defaultdict(int)
+        self.high_value_total = 0
+
+    def consume_table(self, table):
+        # 过滤与高价值计数都在 Arrow 中完成，只有构建事务所需的列转换为 pandas
+        table = table.filter(ds.field('item_category').is_valid() & ds.field('payment_method').is_valid() &
+                             ds.field('purchase_date').is_valid())
+        self.builder.add(table.select(self.builder.columns).to_pandas())
+        high_value = table.filter(ds.field('is_high_value') == True).column('payment_method')
+        for entry in sorted(pc.value_counts(high_value).to_pylist(), key=lambda e: -e['counts']):
+            self.high_value_counts[entry['values']] += entry['counts']
+            self.high_value_total += entry['counts']
+
+    def consume(self, df):
+        self.consume_table(pa.Table.from_pandas(df, preserve_index=False))
+
+    def finish(self):
+        payment_category_transactions = self.builder.build()
+        payment_category_transactions.write_csv(CATEGORY_TRANS_CSV)
+
+        lattice = load_or_mine(payment_category_transactions, MIN_SUPPORT, CACHE_MIN_SUPPORT, name=self.state_name)
+        rules = lattice.rules(MIN_SUPPORT, metric="confidence", min_threshold=MIN_CONFIDENCE)
+        rules.to_csv(RULES_OUTPUT_CSV, index=False)
+
+        # 按计数降序（同计数按名称）排列，与批次的读取顺序无关
+        high_value_df = pd.DataFrame(sorted(self.high_value_counts.items(), key=lambda e: (-e[1], e[0])),
+                                     columns=['payment_method', 'count'])
+        high_value_df['ratio'] = high_value_df['count'] / self.high_value_total
+        high_value_df.to_csv(HIGH_VALUE_STATS_CSV, index=False)
+        return rules, high_value_df
+
+def main(incremental=False):
+    run_scan([PaymentAnalysisTask()], INPUT_DIR, batch_size=CHUNKSIZE, incremental=incremental)
+
+if __name__ == '__main__':
+    main(incremental=parse_scan_args('任务 2：支付方式与品类关联分析').incremental)
\ No newline at end of file
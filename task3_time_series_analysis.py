@@ -1,49 +1,124 @@
 import os
+import numpy as np
 import pandas as pd
-from pyarrow.parquet import ParquetFile
-from collections import defaultdict, Counter
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from scan_driver import run_scan, parse_scan_args
+from transactions import Vocabulary, value_ranks
+from spill import PartitionedSpill
 
 INPUT_DIR = './outputs/expanded_items_chunks'
 OUTPUT_DIR = './outputs/task3'
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 CHUNKSIZE = 500_000
+SEQUENCE_PARTITIONS = 16
+QUARTERS = np.arange(1, 5)
+WEEKDAYS = np.arange(7)
 
-quarter_count = defaultdict(Counter)
-weekday_count = defaultdict(Counter)
-sequence_count = defaultdict(int)
-
-last_user_date_category = {}
-
-for fname in sorted(os.listdir(INPUT_DIR)):
-    if not fname.endswith('.parquet'):
-        continue
-    pf = ParquetFile(os.path.join(INPUT_DIR, fname))
-    for batch in pf.iter_batches(batch_size=CHUNKSIZE):
-        df = batch.to_pandas()
-        df = df.dropna(subset=['id', 'item_category', 'purchase_date'])
-        df['purchase_date'] = pd.to_datetime(df['purchase_date'])
-        df['quarter'] = df['purchase_date'].dt.quarter.astype(str)
-        df['weekday'] = df['purchase_date'].dt.weekday.astype(str)
-        for row in df.itertuples():
-            quarter_count[row.item_category][row.quarter] += 1
-            weekday_count[row.item_category][row.weekday] += 1
-            uid = row.id
-            date = row.purchase_date
-            key = (uid,)
-            last = last_user_date_category.get(key)
-            if last and last[0] < date:
-                sequence = (last[1], row.item_category)
-                sequence_count[sequence] += 1
-            last_user_date_category[key] = (date, row.item_category)
-
-quarter_df = pd.DataFrame(quarter_count).fillna(0).astype(int).T
-quarter_df.columns = [str(c) for c in quarter_df.columns]
-quarter_df.to_csv(os.path.join(OUTPUT_DIR, 'task3_quarterly_category_counts.csv'))
-
-weekday_df = pd.DataFrame(weekday_count).fillna(0).astype(int).T
-weekday_df.columns = [str(c) for c in weekday_df.columns]
-weekday_df.to_csv(os.path.join(OUTPUT_DIR, 'task3_weekday_category_counts.csv'))
-
-sequence_df = pd.DataFrame([{'from_category': k[0], 'to_category': k[1], 'count': v} for k, v in sequence_count.items()])
-sequence_df.sort_values(by='count', ascending=False, inplace=True)
-sequence_df.to_csv(os.path.join(OUTPUT_DIR, 'task3_sequential_category_pairs.csv'), index=False)
\ No newline at end of file
+# 季度/星期直方图按品类编码 bincount 累加；购买顺序不再依赖文件顺序：
+# 每行 (用户哈希, 日期, 品类) 按用户哈希分区落盘，结束时逐个分区按 (用户, 日期, 品类名) 排序，
+# 同一用户相邻两行中日期严格递增的记为一次 (前一品类 → 后一品类) 转移。同一天的多件商品按品类名排列，
+# 结果只取决于数据本身，与读取顺序、布局无关。内存只与单个分区的大小有关。
+
+def encode_categories(vocab, series):
+    # 按首次出现的顺序登记新品类，输出的行顺序与逐行累加时一致
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        vocab.encode(np.asarray(series.cat.categories, dtype=object)[pd.unique(series.cat.codes.to_numpy())])
+    else:
+        vocab.encode(pd.unique(np.asarray(series, dtype=object)))
+    return vocab.encode(series)
+
+def grow(counts, n_rows):
+    if counts.shape[0] >= n_rows:
+        return counts
+    return np.vstack([counts, np.zeros((n_rows - counts.shape[0], counts.shape[1]), dtype=counts.dtype)])
+
+def count_transitions(part, n_categories, category_rank):
+    # category_rank：品类编码 -> 按品类名排序后的名次，作为同一用户同一天内的次序
+    order = np.lexsort([category_rank[part['category']], part['date'], part['user']])
+    user, date, category = part['user'][order], part['date'][order], part['category'][order]
+    step = (user[1:] == user[:-1]) & (date[:-1] < date[1:])
+    pairs = category[:-1][step].astype(np.int64) * n_categories + category[1:][step]
+    return np.bincount(pairs, minlength=n_categories * n_categories)
+
+class TimeSeriesTask:
+    columns = ['user_id', 'item_category', 'purchase_date']
+    state_name = 'task3'
+    config = ('years',)
+
+    def __init__(self, years=None):
+        self.years = sorted(years) if years else None
+        self.vocab = Vocabulary()
+        self.quarter_count = np.zeros((0, len(QUARTERS)), dtype=np.int64)
+        self.weekday_count = np.zeros((0, len(WEEKDAYS)), dtype=np.int64)
+        self.sequences = PartitionedSpill('task3_sequences', ['user', 'date', 'category'], SEQUENCE_PARTITIONS)
+
+    def filter_for(self, schema):
+        # 只分析指定年份：分区布局下按 year 分区剪枝，平铺布局按 purchase_date 的前四位过滤
+        if not self.years:
+            return None
+        if schema is not None and 'year' in schema.names:
+            return ds.field('year').isin(self.years)
+        return pc.utf8_slice_codeunits(ds.field('purchase_date'), 0, 4).isin([str(y) for y in self.years])
+
+    def consume(self, df):
+        df = df.dropna(subset=['user_id', 'item_category', 'purchase_date'])
+        dates = pd.to_datetime(df['purchase_date'])
+        valid = dates.notna().to_numpy()
+        df, dates = df[valid], dates[valid]
+        if df.empty:
+            return
+        codes = encode_categories(self.vocab, df['item_category'])
+        n = len(self.vocab)
+        self.quarter_count = grow(self.quarter_count, n)
+        self.weekday_count = grow(self.weekday_count, n)
+        quarter = dates.dt.quarter.to_numpy() - 1
+        weekday = dates.dt.weekday.to_numpy()
+        self.quarter_count += np.bincount(codes * 4 + quarter, minlength=n * 4).reshape(n, 4)
+        self.weekday_count += np.bincount(codes * 7 + weekday, minlength=n * 7).reshape(n, 7)
+
+        user = pd.util.hash_pandas_object(df['user_id'], index=False).to_numpy()
+        self.sequences.append((user % np.uint64(SEQUENCE_PARTITIONS)).astype(np.int64),
+                              user=user, date=dates.to_numpy().astype('datetime64[ns]').view(np.int64),
+                              category=codes)
+
+    def histogram(self, counts, labels):
+        # 行按品类名排列，与品类首次出现的顺序无关
+        present = counts.sum(axis=0) > 0
+        order = np.argsort(value_ranks(self.vocab.values))
+        return pd.DataFrame(counts[order][:, present], index=pd.Index(self.vocab.values[order]),
+                            columns=[str(label) for label in labels[present]])
+
+    def finish(self):
+        quarter_df = self.histogram(self.quarter_count, QUARTERS)
+        quarter_df.to_csv(os.path.join(OUTPUT_DIR, 'task3_quarterly_category_counts.csv'))
+
+        weekday_df = self.histogram(self.weekday_count, WEEKDAYS)
+        weekday_df.to_csv(os.path.join(OUTPUT_DIR, 'task3_weekday_category_counts.csv'))
+
+        n = len(self.vocab)
+        rank = value_ranks(self.vocab.values)
+        sequence_count = np.zeros(n * n, dtype=np.int64)
+        for p in range(SEQUENCE_PARTITIONS):
+            part = self.sequences.load_partition(p)
+            if part is not None:
+                sequence_count += count_transitions(part, n, rank)
+        self.sequences.remove_stale()
+        pairs = np.flatnonzero(sequence_count)
+        names = self.vocab.values
+        sequence_df = pd.DataFrame({'from_category': names[pairs // max(n, 1)], 'to_category': names[pairs % max(n, 1)],
+                                    'count': sequence_count[pairs]}, columns=['from_category', 'to_category', 'count'])
+        sequence_df.sort_values(by=['count', 'from_category', 'to_category'], ascending=[False, True, True],
+                                kind='stable', inplace=True)
+        sequence_df.to_csv(os.path.join(OUTPUT_DIR, 'task3_sequential_category_pairs.csv'), index=False)
+        return quarter_df, weekday_df, sequence_df
+
+def main(incremental=False, years=None):
+    run_scan([TimeSeriesTask(years)], INPUT_DIR, batch_size=CHUNKSIZE, incremental=incremental)
+
+def add_years_argument(parser):
+    parser.add_argument('--years', type=int, nargs='+', help='只分析这些年份的购买记录')
+
+if __name__ == '__main__':
+    args = parse_scan_args('任务 3：时间序列与购买顺序分析', add_years_argument)
+    main(incremental=args.incremental, years=args.years)
\ No newline at end of file
@@ -1,8 +1,8 @@
 import os
-import pandas as pd
-from pyarrow.parquet import ParquetFile
-from mlxtend.frequent_patterns import fpgrowth, association_rules
-from sklearn.preprocessing import MultiLabelBinarizer
+import pyarrow.dataset as ds
+from scan_driver import run_scan, parse_scan_args
+from transactions import TransactionBuilder
+from rule_cache import load_or_mine
 
 INPUT_DIR = './outputs/expanded_items_chunks'
 OUTPUT_DIR = './outputs/task4'
@@ -12,32 +12,39 @@ RULES_CSV = os.path.join(OUTPUT_DIR, 'task4_rules.csv')
 FREQ_CSV = os.path.join(OUTPUT_DIR, 'task4_frequent_itemsets.csv')
 MIN_SUPPORT = 0.005
 MIN_CONFIDENCE = 0.4
+# 频繁项集按该支持度挖掘并缓存（见 rule_cache.py），调高阈值后重新运行或查询时不必重跑 FP-Growth
+CACHE_MIN_SUPPORT = 0.002
 CHUNKSIZE = 500_000
+REFUND_STATUSES = ['已退款', '部分退款']
 
-transactions = []
-
-for fname in sorted(os.listdir(INPUT_DIR)):
-    if not fname.endswith('.parquet'):
-        continue
-    pf = ParquetFile(os.path.join(INPUT_DIR, fname))
-    for batch in pf.iter_batches(batch_size=CHUNKSIZE):
-        df = batch.to_pandas()
-        df = df.dropna(subset=['payment_status', 'item_category'])
-        df = df[df['payment_status'].isin(['已退款', '部分退款'])]
-        grouped = df.groupby(['id', 'purchase_date'])
-        for _, group in grouped:
-            refund_status = group['payment_status'].iloc[0]
-            label = 'STATUS_已退款' if refund_status == '已退款' else 'STATUS_部分退款'
-            cats = list(set(group['item_category']))
-            if cats:
-                transactions.append([label] + cats)
-
-pd.Series(transactions).to_csv(TRANS_CSV, index=False, header=False)
-
-mlb = MultiLabelBinarizer()
-onehot = pd.DataFrame(mlb.fit_transform(transactions), columns=mlb.classes_)
-freq_itemsets = fpgrowth(onehot, min_support=MIN_SUPPORT, use_colnames=True)
-rules = association_rules(freq_itemsets, metric="confidence", min_threshold=MIN_CONFIDENCE)
-
-freq_itemsets.to_csv(FREQ_CSV, index=False)
-rules.to_csv(RULES_CSV, index=False)
\ No newline at end of file
+class RefundPatternTask:
+    columns = ['user_id', 'purchase_date', 'payment_status', 'item_category']
+    state_name = 'task4'
+    # 只解码退款记录：条件下推到 parquet 扫描
+    filter = ds.field('payment_status').isin(REFUND_STATUSES) & ds.field('item_category').is_valid()
+
+    def __init__(self):
+        self.builder = TransactionBuilder(['user_id', 'purchase_date'], 'item_category',
+                                          label_column='payment_status', label_prefix='STATUS_',
+                                          name=self.state_name)
+
+    def consume(self, df):
+        self.builder.add(df)
+
+    def finish(self):
+        transactions = self.builder.build()
+        transactions.write_csv(TRANS_CSV)
+
+        lattice = load_or_mine(transactions, MIN_SUPPORT, CACHE_MIN_SUPPORT, name=self.state_name)
+        freq_itemsets = lattice.frequent_itemsets(MIN_SUPPORT)
+        rules = lattice.rules(MIN_SUPPORT, metric="confidence", min_threshold=MIN_CONFIDENCE)
+
+        freq_itemsets.to_csv(FREQ_CSV, index=False)
+        rules.to_csv(RULES_CSV, index=False)
+        return freq_itemsets, rules
+
+def main(incremental=False):
+    run_scan([RefundPatternTask()], INPUT_DIR, batch_size=CHUNKSIZE, incremental=incremental)
+
+if __name__ == '__main__':
+    main(incremental=parse_scan_args('任务 4：退款模式分析').incremental)
\ No newline at end of file
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mlxtend.frequent_patterns import fpgrowth, association_rules
+from sklearn.preprocessing import MultiLabelBinarizer
+
+import transactions as transactions_module
+from dedup import DEDUP_KEYS, DedupFilter, SortedKeySet, hash_keys
+from mining import mine_frequent_itemsets, transactions_to_sparse_frame
+from rule_cache import ItemsetLattice
+from sketch import KLLSketch
+from transactions import TransactionBuilder
+
+# 各项优化路径与原实现（Python 集合 / pandas / MultiLabelBinarizer + 稠密 fpgrowth）在小数据上逐项对比
+
+CATEGORIES = ['电子产品', '服装', '食品', '家居', '玩具', '书籍']
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # 各模块的输出与状态路径都相对于当前目录
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def make_purchases(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'user_id': rng.integers(0, 150, n),
+        'purchase_date': pd.to_datetime('2024-01-01') + pd.to_timedelta(rng.integers(0, 8, n), unit='D'),
+        'item_category': rng.choice(CATEGORIES, n, p=[0.3, 0.25, 0.2, 0.1, 0.1, 0.05]),
+        'payment_method': rng.choice(['支付宝', '微信支付', '信用卡'], n),
+    })
+
+def make_lists(n=400, seed=1):
+    df = make_purchases(n * 3, seed)
+    grouped = df.groupby(['user_id', 'purchase_date'])['item_category'].agg(lambda s: sorted(set(s)))
+    # 加入品类间的关联，使置信度阈值下仍有规则
+    rng = np.random.default_rng(seed)
+    lists = []
+    for items in grouped:
+        if '电子产品' in items and rng.random() < 0.8:
+            items = sorted(set(items) | {'书籍'})
+        if '食品' in items and rng.random() < 0.7:
+            items = sorted(set(items) | {'家居'})
+        if len(items) > 1:
+            lists.append(items)
+    return lists
+
+def as_itemset_table(itemsets):
+    return {frozenset(s): round(float(v), 12) for s, v in zip(itemsets['itemsets'], itemsets['support'])}
+
+def as_rule_table(rules):
+    return {(frozenset(a), frozenset(c)): (round(float(conf), 12), round(float(lift), 12))
+            for a, c, conf, lift in zip(rules['antecedents'], rules['consequents'], rules['confidence'], rules['lift'])}
+
+def dense_itemsets(lists, min_support):
+    mlb = MultiLabelBinarizer()
+    encoded = pd.DataFrame(mlb.fit_transform(lists), columns=mlb.classes_)
+    return fpgrowth(encoded, min_support=min_support, use_colnames=True)
+
+def build_transactions(lists):
+    builder = TransactionBuilder(['order'], 'item')
+    builder.add(pd.DataFrame({'order': np.repeat(np.arange(len(lists)), [len(t) for t in lists]),
+                              'item': [item for t in lists for item in t]}))
+    return builder.build()
+
+def test_sorted_key_set_matches_python_set():
+    rng = np.random.default_rng(0)
+    keys = SortedKeySet()
+    seen = set()
+    for _ in range(5):
+        # h1 取值很少，保证出现 h1 相同、h2 不同的键
+        h1 = rng.integers(0, 50, 400).astype(np.uint64)
+        h2 = rng.integers(0, 1000, 400).astype(np.uint64)
+        expected = np.array([(a, b) in seen for a, b in zip(h1.tolist(), h2.tolist())])
+        np.testing.assert_array_equal(keys.contains(h1, h2), expected)
+        keys.add(h1, h2)
+        seen.update(zip(h1.tolist(), h2.tolist()))
+    h1 = np.array([u for u, _ in seen], dtype=np.uint64)
+    h2 = np.array([v for _, v in seen], dtype=np.uint64)
+    assert keys.contains(h1, h2).all()
+    assert not keys.contains(h1, h2 + np.uint64(1000)).any()
+
+def make_users(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'id': rng.integers(0, 300, n),
+        'last_login': rng.choice(['2024-01-01', '2024-02-01', '2024-03-01'], n),
+        'user_name': rng.choice(['a', 'b', 'c', 'd'], n),
+        'age': rng.integers(18, 80, n),
+    })
+    return df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+@pytest.mark.parametrize('chunksize', [97, 2000])
+def test_exact_dedup_matches_drop_duplicates(chunksize):
+    df = make_users()
+    dedup = DedupFilter(mode='exact')
+    kept = []
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        kept.append(chunk[~dedup.check_and_add(*hash_keys(chunk))])
+    pd.testing.assert_frame_equal(pd.concat(kept), df.drop_duplicates(subset=DEDUP_KEYS, keep='first'))
+
+def test_bloom_dedup_never_keeps_a_duplicate():
+    df = make_users()
+    dedup = DedupFilter(mode='bloom', error_rate=0.001, initial_capacity=64)
+    kept = []
+    for start in range(0, len(df), 97):
+        chunk = df.iloc[start:start + 97]
+        kept.append(chunk[~dedup.check_and_add(*hash_keys(chunk))])
+    kept = pd.concat(kept)
+    # 布隆过滤器只会误删（假阳性），不会漏删
+    assert not kept.duplicated(subset=DEDUP_KEYS).any()
+    assert kept.index.isin(df.drop_duplicates(subset=DEDUP_KEYS).index).all()
+
+def test_parallel_clean_matches_sequential(workdir):
+    from synthetic_data import generate
+    generate(str(workdir), rows=4000, files=3, duplicate_rate=0.05, repeat_purchase_rate=0.2, catalog_size=200,
+             row_group_size=500, seed=3)
+    from clean_and_dedup import preprocess
+
+    def run(output_dir, **kwargs):
+        stats = preprocess('data', output_dir, dedup_mode='exact', chunksize=700, **kwargs)
+        cleaned = pd.concat([pd.read_parquet(p) for p in sorted((workdir / output_dir).glob('*.parquet'))])
+        return stats, cleaned.sort_values(['id', 'last_login', 'user_name']).reset_index(drop=True)
+
+    sequential, expected = run('sequential')
+    parallel, cleaned = run('parallel', workers=2)
+    assert parallel['duplicates_removed'] == sequential['duplicates_removed'] > 0
+    assert dict(parallel['missing_filled']) == dict(sequential['missing_filled'])
+    assert dict(parallel['outliers_removed']) == dict(sequential['outliers_removed'])
+    pd.testing.assert_frame_equal(cleaned, expected)
+
+def pandas_transactions(df, min_items, label_column=None, label_prefix=''):
+    # 原实现的语义：按订单键分组，项去重后按名称排序，标签取排序最前的值作为首项，项数不足 min_items 的订单丢弃
+    result = []
+    for _, group in df.dropna().groupby(['user_id', 'purchase_date'], sort=True):
+        items = sorted(set(group['item_category']))
+        if len(items) < min_items:
+            continue
+        if label_column:
+            items = [label_prefix + min(group[label_column].astype(str))] + items
+        result.append(items)
+    return result
+
+@pytest.mark.parametrize('spill_partitions', [1, 4])
+@pytest.mark.parametrize('label_column', [None, 'payment_method'])
+def test_transaction_builder_matches_pandas_groupby(monkeypatch, spill_partitions, label_column):
+    monkeypatch.setitem(transactions_module.settings, 'spill_partitions', spill_partitions)
+    df = make_purchases()
+    df.loc[df.sample(frac=0.02, random_state=0).index, 'item_category'] = None
+    builder = TransactionBuilder(['user_id', 'purchase_date'], 'item_category', label_column=label_column,
+                                 label_prefix='支付:', min_items=2, name='test')
+    # 打乱后分批加入，同一订单的行分散在不同批次
+    shuffled = df.sample(frac=1.0, random_state=1)
+    for start in range(0, len(shuffled), 250):
+        builder.add(shuffled.iloc[start:start + 250])
+    built = builder.build()
+    assert (built.partition_paths is not None) == (spill_partitions > 1)
+    assert [list(t) for t in built.to_lists()] == pandas_transactions(df, 2, label_column, '支付:')
+
+def test_sparse_onehot_matches_dense_fpgrowth():
+    lists = make_lists()
+    sparse_itemsets = fpgrowth(transactions_to_sparse_frame(build_transactions(lists)), min_support=0.05, use_colnames=True)
+    assert as_itemset_table(sparse_itemsets) == as_itemset_table(dense_itemsets(lists, 0.05))
+
+def test_son_partitions_match_fpgrowth():
+    lists = make_lists()
+    itemsets = mine_frequent_itemsets(build_transactions(lists), 0.05, partitions=3, workers=2)
+    assert as_itemset_table(itemsets) == as_itemset_table(dense_itemsets(lists, 0.05))
+
+def test_spilled_son_matches_fpgrowth(monkeypatch):
+    monkeypatch.setitem(transactions_module.settings, 'spill_partitions', 3)
+    df = make_purchases()
+    builder = TransactionBuilder(['user_id', 'purchase_date'], 'item_category', min_items=2, name='test')
+    builder.add(df)
+    built = builder.build()
+    itemsets = mine_frequent_itemsets(built, 0.05, partitions=3, workers=2)
+    assert as_itemset_table(itemsets) == as_itemset_table(dense_itemsets(pandas_transactions(df, 2), 0.05))
+
+def test_lattice_rules_match_association_rules():
+    lists = make_lists()
+    transactions = build_transactions(lists)
+    lattice = ItemsetLattice.from_frame(mine_frequent_itemsets(transactions, 0.02), transactions.vocab, len(transactions), 0.02)
+    for min_support in (0.02, 0.05):
+        expected = association_rules(dense_itemsets(lists, min_support), metric='confidence', min_threshold=0.3)
+        assert as_rule_table(lattice.rules(min_support, min_threshold=0.3)) == as_rule_table(expected)
+        assert as_itemset_table(lattice.frequent_itemsets(min_support)) == as_itemset_table(dense_itemsets(lists, min_support))
+    with pytest.raises(ValueError):
+        lattice.select(0.01)
+
+def test_focus_rules_match_filtered_rules():
+    from task1_association_rules import MIN_CONFIDENCE, MIN_SUPPORT, focus_rules
+    lists = make_lists()
+    transactions = build_transactions(lists)
+    lattice = ItemsetLattice.from_frame(mine_frequent_itemsets(transactions, MIN_SUPPORT), transactions.vocab,
+                                        len(transactions), MIN_SUPPORT)
+    rules = association_rules(dense_itemsets(lists, MIN_SUPPORT), metric='confidence', min_threshold=MIN_CONFIDENCE)
+    for category in ('电子产品', '食品'):
+        involved = (rules['antecedents'].apply(lambda x: any(category in s for s in x)) |
+                    rules['consequents'].apply(lambda x: any(category in s for s in x)))
+        assert len(rules[involved]) > 0
+        assert as_rule_table(focus_rules(lattice, category)) == as_rule_table(rules[involved])
+
+def rank_error(values, estimates, qs):
+    ranks = np.searchsorted(np.sort(values), estimates, side='right') / len(values)
+    return np.max(np.abs(ranks - qs))
+
+def test_sketch_quantiles_within_rank_error():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(6.0, 1.2, 200_000)
+    qs = np.linspace(0.01, 0.99, 99)
+    single = KLLSketch(seed=0)
+    single.update(values)
+    merged = KLLSketch(seed=0)
+    for chunk in np.array_split(values, 7):
+        part = KLLSketch(seed=1)
+        part.update(chunk)
+        merged.merge(part)
+    assert single.n == merged.n == len(values)
+    # k=400 时归一化秩误差远小于 1%
+    assert rank_error(values, single.quantiles(qs), qs) < 0.01
+    assert rank_error(values, merged.quantiles(qs), qs) < 0.01
+
+def test_sketch_is_exact_below_capacity():
+    values = np.random.default_rng(0).normal(size=300)
+    sketch = KLLSketch()
+    sketch.update(values)
+    qs = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+    np.testing.assert_array_equal(sketch.quantiles(qs), np.quantile(values, qs, method='inverted_cdf'))
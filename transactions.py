@@ -0,0 +1,329 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from spill import PartitionedSpill
+
+CSV_BLOCK = 100_000
+# spill_partitions > 1 时（由 --mining-partitions 设置，见 mining.configure），TransactionBuilder 在扫描期间
+# 按订单键的哈希把行分区落盘，build() 逐个分区分组，再按键归并成磁盘上的 CSR（内存映射），
+# 完整的事务从不整体载入内存；SON 分区挖掘直接使用各分区的事务文件
+settings = {'spill_partitions': 1}
+
+class Vocabulary:
+    # 字符串/类别值到连续小整数编码的增量字典
+    def __init__(self, values=()):
+        self.index = pd.Index(list(values), dtype=object)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def values(self):
+        return self.index.to_numpy()
+
+    def encode(self, values):
+        if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.remove_unused_categories()
+            category_codes = self.encode(np.asarray(values.cat.categories, dtype=object))
+            return category_codes[values.cat.codes.to_numpy()]
+        values = np.asarray(values, dtype=object)
+        codes = self.index.get_indexer(values)
+        new = codes < 0
+        if new.any():
+            self.index = self.index.append(pd.Index(pd.unique(values[new]), dtype=object))
+            codes[new] = self.index.get_indexer(values[new])
+        return codes.astype(np.int32)
+
+class Transactions:
+    # CSR 结构：第 i 条事务的项编码为 items[offsets[i]:offsets[i + 1]]，编码到项名见 vocab。
+    # offsets / items 可以是内存映射的数组；partition_paths 为按键分区保存的同一批事务（见 TransactionBuilder）
+    def __init__(self, offsets, items, vocab, partition_paths=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.items = np.asarray(items, dtype=np.int32)
+        self.vocab = np.asarray(vocab, dtype=object)
+        self.partition_paths = partition_paths
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def slice(self, start, stop):
+        offsets = self.offsets[start:stop + 1]
+        return Transactions(offsets - offsets[0], self.items[offsets[0]:offsets[-1]], self.vocab)
+
+    def iter_lists(self, block=CSV_BLOCK):
+        for start in range(0, len(self), block):
+            part = self.slice(start, min(start + block, len(self)))
+            names = self.vocab[part.items]
+            yield [list(names[a:b]) for a, b in zip(part.offsets[:-1], part.offsets[1:])]
+
+    def to_lists(self):
+        return [tx for block in self.iter_lists() for tx in block]
+
+    def save(self, path, **arrays):
+        # 保存为目录下的 .npy 文件，可按内存映射方式读取；arrays 为附带保存的其他数组
+        os.makedirs(path, exist_ok=True)
+        for name, array in dict(arrays, offsets=self.offsets, items=self.items).items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+
+    @staticmethod
+    def load(path, vocab, mmap_mode=None):
+        return Transactions(np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode),
+                            np.load(os.path.join(path, 'items.npy'), mmap_mode=mmap_mode), vocab)
+
+    def write_csv(self, path):
+        # 与 pd.Series(list_of_lists).to_csv(index=False, header=False) 的输出格式一致，按块写出
+        open(path, 'w').close()
+        for block in self.iter_lists():
+            pd.Series(block).to_csv(path, mode='a', index=False, header=False)
+
+    @staticmethod
+    def concat(parts, vocab):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return Transactions(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), vocab)
+        shifts = np.cumsum([0] + [len(p.items) for p in parts[:-1]])
+        offsets = np.concatenate([parts[0].offsets[:1]] + [p.offsets[1:] + s for p, s in zip(parts, shifts)])
+        return Transactions(offsets, np.concatenate([p.items for p in parts]), vocab)
+
+def group_transactions(keys, items, labels=None, rows=None, min_items=1, order='sorted', return_keys=False):
+    # keys: 各键列的整数编码数组；items: 项编码；labels: 每行的标签项编码（取每组第一行的值放在事务首位）
+    # rows: 行的全局顺序号，order='first_seen' 时按每组首次出现的位置排列事务，否则按键排序
+    # 全部通过排序 + 相邻比较完成，返回 CSR 的 (offsets, items)；return_keys 时另返回每条事务的各键列
+    n = len(items)
+    if rows is None:
+        rows = np.arange(n, dtype=np.int64)
+    if n == 0:
+        empty = np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32)
+        return empty + ([k[:0] for k in keys],) if return_keys else empty
+    perm = np.lexsort([rows] + list(keys[::-1]))
+    new_group = np.zeros(n, dtype=bool)
+    new_group[0] = True
+    for k in keys:
+        k = k[perm]
+        new_group[1:] |= k[1:] != k[:-1]
+    group_starts = np.flatnonzero(new_group)
+    group_id = np.cumsum(new_group) - 1
+    first_row = rows[perm[group_starts]]
+
+    # 组内按项编码排序并去重
+    sorted_items = items[perm]
+    by_item = np.lexsort([sorted_items, group_id])
+    g, it = group_id[by_item], sorted_items[by_item]
+    keep = np.ones(n, dtype=bool)
+    keep[1:] = (g[1:] != g[:-1]) | (it[1:] != it[:-1])
+    g, it = g[keep], it[keep]
+    counts = np.bincount(g, minlength=len(group_starts))
+
+    selected = np.flatnonzero(counts >= min_items)
+    if order == 'first_seen':
+        selected = selected[np.argsort(first_row[selected], kind='stable')]
+    rank = np.full(len(group_starts), -1, dtype=np.int64)
+    rank[selected] = np.arange(len(selected))
+    extra = 0 if labels is None else 1
+    lengths = counts[selected] + extra
+    offsets = np.zeros(len(selected) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    out = np.empty(offsets[-1], dtype=np.int32)
+    item_rank = rank[g]
+    valid = item_rank >= 0
+    within = np.arange(len(g)) - np.concatenate([[0], np.cumsum(counts)])[g]
+    out[offsets[item_rank[valid]] + extra + within[valid]] = it[valid]
+    if labels is not None:
+        out[offsets[:-1]] = labels[perm[group_starts]][selected]
+    if return_keys:
+        return offsets, out, [k[perm[group_starts]][selected] for k in keys]
+    return offsets, out
+
+def lex_less_equal(keys, bound):
+    # 逐行判断 (keys[0], keys[1], ...) 按字典序是否不大于 bound
+    less = np.zeros(len(keys[0]), dtype=bool)
+    equal = np.ones(len(keys[0]), dtype=bool)
+    for key, b in zip(keys, bound):
+        less |= equal & (key < b)
+        equal &= key == b
+    return less | equal
+
+def merge_partitions(paths, n_keys, path, vocab, block=CSV_BLOCK):
+    # 各分区的事务已按键排序且键互不相同：分块归并成按键排序的一份 CSR，写入 path 下的内存映射文件。
+    # 每轮从各分区取至多 block 条，未取到末尾的分区中最后一个键的最小值为截止键，不超过它的事务已可输出
+    parts = [(Transactions.load(p, vocab, mmap_mode='r'),
+              [np.load(os.path.join(p, f"key{i}.npy"), mmap_mode='r') for i in range(n_keys)]) for p in paths]
+    n_tx = sum(len(tx) for tx, _ in parts)
+    n_items = sum(int(tx.offsets[-1]) for tx, _ in parts)
+    os.makedirs(path, exist_ok=True)
+    offsets = open_memmap(os.path.join(path, 'offsets.npy'), mode='w+', dtype=np.int64, shape=(n_tx + 1,))
+    items = open_memmap(os.path.join(path, 'items.npy'), mode='w+', dtype=np.int32, shape=(n_items,))
+    offsets[0] = 0
+    positions = [0] * len(parts)
+    tx_pos = item_pos = 0
+    while tx_pos < n_tx:
+        chunks = [(p, positions[p], min(positions[p] + block, len(tx))) for p, (tx, _) in enumerate(parts)
+                  if positions[p] < len(tx)]
+        bounds = [tuple(key[stop - 1] for key in parts[p][1]) for p, start, stop in chunks if stop < len(parts[p][0])]
+        bound = min(bounds) if bounds else None
+        keys, lengths, pieces = [[] for _ in range(n_keys)], [], []
+        for p, start, stop in chunks:
+            tx, part_keys = parts[p]
+            chunk_keys = [np.asarray(key[start:stop]) for key in part_keys]
+            stop = start + (int(lex_less_equal(chunk_keys, bound).sum()) if bound is not None else stop - start)
+            for i in range(n_keys):
+                keys[i].append(chunk_keys[i][:stop - start])
+            piece = tx.slice(start, stop)
+            lengths.append(piece.lengths)
+            pieces.append(np.asarray(piece.items))
+            positions[p] = stop
+        keys = [np.concatenate(k) for k in keys]
+        lengths, merged = np.concatenate(lengths), np.concatenate(pieces)
+        order = np.lexsort(keys[::-1])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[order]
+        lengths = lengths[order]
+        out_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        gather = np.repeat(starts - out_starts, lengths) + np.arange(lengths.sum())
+        items[item_pos:item_pos + len(gather)] = merged[gather]
+        offsets[tx_pos + 1:tx_pos + 1 + len(lengths)] = item_pos + np.cumsum(lengths)
+        tx_pos += len(lengths)
+        item_pos += len(gather)
+    offsets.flush()
+    items.flush()
+    del offsets, items
+    return Transactions.load(path, vocab, mmap_mode='r')
+
+def is_plain_numeric(series):
+    return pd.api.types.is_numeric_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype)
+
+def value_ranks(values):
+    # 编码 -> 按值排序后的名次
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[np.argsort(np.asarray(values).astype(str), kind='stable')] = np.arange(len(values))
+    return ranks
+
+class TransactionBuilder:
+    # 以 key_columns 为订单键、item_column 为项构建事务。始终跨批次全局分组：同一订单的行无论落在哪个批次、
+    # 哪个文件（平铺或分区布局、内存预算决定的批次大小、下推的过滤条件）都归入同一条事务。
+    # 事务按键值排序，事务内的项按项名排序，因此结果与读取顺序无关。
+    # label_column 给出时，每条事务以 label_prefix + 该组的标签值作为首项。
+    # name 给出且 settings['spill_partitions'] > 1 时，扫描期间的行按订单键哈希分区落盘（STATE_DIR/<name>_transactions），
+    # 内存只与单个分区的大小有关，build() 返回内存映射的事务
+    def __init__(self, key_columns, item_column, label_column=None, label_prefix='', min_items=1, name=None):
+        self.key_columns = list(key_columns)
+        self.item_column = item_column
+        self.label_column = label_column
+        self.label_prefix = label_prefix
+        self.min_items = min_items
+        self.vocab = Vocabulary()
+        self.key_vocabs = {col: Vocabulary() for col in self.key_columns}
+        self.parts = []
+        self.rows_seen = 0
+        self.spill = None
+        if name is not None and settings['spill_partitions'] > 1:
+            columns = [f"k{i}" for i in range(len(self.key_columns))] + ['item'] + (['label'] if label_column else [])
+            self.spill = PartitionedSpill(f"{name}_transactions", columns, settings['spill_partitions'])
+
+    @property
+    def columns(self):
+        columns = self.key_columns + [self.item_column] + ([self.label_column] if self.label_column else [])
+        return list(dict.fromkeys(columns))
+
+    def encode_key(self, col, series):
+        if is_plain_numeric(series):
+            return series.to_numpy()
+        return self.key_vocabs[col].encode(series)
+
+    def encode_labels(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.cat.remove_unused_categories()
+            return self.vocab.encode(series.cat.rename_categories([f"{self.label_prefix}{c}" for c in series.cat.categories]))
+        return self.vocab.encode(self.label_prefix + series.astype(str))
+
+    def add(self, df):
+        df = df[self.columns].dropna()
+        if df.empty:
+            return
+        items = self.vocab.encode(df[self.item_column])
+        labels = self.encode_labels(df[self.label_column]) if self.label_column else None
+        keys = [self.encode_key(col, df[col]) for col in self.key_columns]
+        rows = np.arange(self.rows_seen, self.rows_seen + len(df), dtype=np.int64)
+        self.rows_seen += len(df)
+        # 批内先去掉重复的 (键, 项, 标签)，只保留首次出现的行
+        frame = pd.DataFrame({f"k{i}": k for i, k in enumerate(keys)})
+        frame['item'] = items
+        if labels is not None:
+            frame['label'] = labels
+        first = ~frame.duplicated().to_numpy()
+        if self.spill is not None:
+            # 同一订单键的行总是落入同一分区，各分区可以独立分组
+            columns = {f"k{i}": k[first] for i, k in enumerate(keys)}
+            partition = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+            self.spill.append((partition % np.uint64(self.spill.partitions)).astype(np.int64), item=items[first],
+                              label=labels[first] if labels is not None else None, **columns)
+            return
+        self.parts.append(([k[first] for k in keys], items[first], rows[first],
+                           labels[first] if labels is not None else None))
+
+    def compact(self):
+        # 把逐批累积的分片合并为一个，便于持久化后在增量运行中继续追加
+        if len(self.parts) <= 1:
+            return
+        keys = [np.concatenate([p[0][i] for p in self.parts]) for i in range(len(self.key_columns))]
+        labels = np.concatenate([p[3] for p in self.parts]) if self.label_column else None
+        self.parts = [(keys, np.concatenate([p[1] for p in self.parts]), np.concatenate([p[2] for p in self.parts]), labels)]
+
+    def __getstate__(self):
+        self.compact()
+        return self.__dict__
+
+    def key_ranks(self):
+        # 编码按首次出现的顺序分配，分组前换成按值排序的名次，使事务与项的顺序只取决于数据本身；数值键直接使用原值
+        return [value_ranks(self.key_vocabs[col].values) if len(self.key_vocabs[col]) else None for col in self.key_columns]
+
+    def group(self, keys, items, rows, labels, key_ranks, item_ranks, return_keys=False):
+        keys = [k if r is None else r[k] for k, r in zip(keys, key_ranks)]
+        labels = item_ranks[labels] if labels is not None else None
+        # 同一事务出现多个标签值时取排序最前的一个，同样与读取顺序无关
+        return group_transactions(keys, item_ranks[items], labels=labels, rows=rows if labels is None else labels,
+                                  min_items=self.min_items, return_keys=return_keys)
+
+    def build(self):
+        item_ranks = value_ranks(self.vocab.values)
+        # 输出的项编码即名次，词表按项名排序，相同数据得到完全相同的事务
+        vocab = self.vocab.values[np.argsort(item_ranks)]
+        if self.spill is not None:
+            return self.build_spilled(item_ranks, vocab)
+        if not self.parts:
+            return Transactions.concat([], vocab)
+        keys = [np.concatenate([p[0][i] for p in self.parts]) for i in range(len(self.key_columns))]
+        labels = np.concatenate([p[3] for p in self.parts]) if self.label_column else None
+        offsets, out = self.group(keys, np.concatenate([p[1] for p in self.parts]), np.concatenate([p[2] for p in self.parts]),
+                                  labels, self.key_ranks(), item_ranks)
+        return Transactions(offsets, out, vocab)
+
+    def build_spilled(self, item_ranks, vocab):
+        # 逐个分区分组并保存（含每条事务的键），再按键归并；结果与内存中一次分组完全相同
+        directory = f"{self.spill.directory}_build"
+        shutil.rmtree(directory, ignore_errors=True)
+        key_ranks = self.key_ranks()
+        paths = []
+        for p in range(self.spill.partitions):
+            part = self.spill.load_partition(p)
+            if part is None:
+                continue
+            keys = [part[f"k{i}"] for i in range(len(self.key_columns))]
+            offsets, out, tx_keys = self.group(keys, part['item'], None, part.get('label'), key_ranks, item_ranks,
+                                               return_keys=True)
+            if len(offsets) > 1:
+                path = os.path.join(directory, f"part_{p}")
+                Transactions(offsets, out, vocab).save(path, **{f"key{i}": k for i, k in enumerate(tx_keys)})
+                paths.append(path)
+        self.spill.remove_stale()
+        if not paths:
+            return Transactions.concat([], vocab)
+        merged = merge_partitions(paths, len(self.key_columns), os.path.join(directory, 'merged'), vocab)
+        merged.partition_paths = paths
+        return merged